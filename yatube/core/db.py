@@ -0,0 +1,15 @@
+from django.conf import settings
+
+
+def apply_pragmas(cursor, pragmas):
+    """Выполняет PRAGMA из словаря на курсоре DB-API."""
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Применяет SQLITE_PRAGMAS к каждому новому соединению SQLite."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, settings.SQLITE_PRAGMAS)
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.db import apply_pragmas
+
+SCHEMA = (
+    'CREATE TABLE post (id INTEGER PRIMARY KEY, text TEXT, pub_date REAL)',
+    'CREATE INDEX post_pub_date ON post (pub_date DESC)',
+)
+READ_SQL = 'SELECT id, text FROM post ORDER BY pub_date DESC LIMIT 10'
+WRITE_SQL = 'INSERT INTO post (text, pub_date) VALUES (?, ?)'
+SEED_ROWS = 10000
+
+
+def run_profile(path, pragmas, readers, writers, seconds):
+    """Смешанная нагрузка на отдельный файл базы: читатели листают
+    ленту, писатели фиксируют по одной записи, как комментарий или
+    подписка. Возвращает число чтений, записей и ошибок блокировки."""
+    db = sqlite3.connect(path)
+    apply_pragmas(db, pragmas)
+    for sql in SCHEMA:
+        db.execute(sql)
+    db.executemany(WRITE_SQL, (
+        (f'Пост {number}', number) for number in range(SEED_ROWS)
+    ))
+    db.commit()
+    db.close()
+    counts = {'read': 0, 'write': 0, 'locked': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(kind):
+        db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        apply_pragmas(db, pragmas)
+        done = locked = 0
+        while time.monotonic() < deadline:
+            try:
+                if kind == 'read':
+                    db.execute(READ_SQL).fetchall()
+                else:
+                    with db:
+                        db.execute(WRITE_SQL, ('Новый пост', time.time()))
+                done += 1
+            except sqlite3.OperationalError:
+                locked += 1
+        db.close()
+        with lock:
+            counts[kind] += done
+            counts['locked'] += locked
+
+    threads = [
+        threading.Thread(target=worker, args=(kind,))
+        for kind, number in (('read', readers), ('write', writers))
+        for _ in range(number)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность SQLite при смешанной '
+            'нагрузке без настроек и с SQLITE_PRAGMAS')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=3)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+
+    def handle(self, *args, **options):
+        profiles = (
+            ('по умолчанию', {}),
+            ('SQLITE_PRAGMAS', settings.SQLITE_PRAGMAS),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            for number, (name, pragmas) in enumerate(profiles):
+                counts = run_profile(
+                    os.path.join(directory, f'bench_{number}.sqlite3'),
+                    pragmas, options['readers'], options['writers'],
+                    options['seconds'],
+                )
+                self.stdout.write(
+                    f'{name}: чтений/с '
+                    f'{counts["read"] / options["seconds"]:.0f}, '
+                    f'записей/с {counts["write"] / options["seconds"]:.0f}, '
+                    f'ошибок блокировки {counts["locked"]}'
+                )
@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def copy_database(source, target):
+    """Согласованная копия базы SQLite через backup API: запись
+    в основную базу на время копирования не останавливается."""
+    primary = sqlite3.connect(source)
+    replica = sqlite3.connect(target, timeout=30)
+    try:
+        primary.backup(replica)
+    finally:
+        replica.close()
+        primary.close()
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в реплики из DATABASE_REPLICAS; '
+            'с --interval повторяет копирование, изображая отстающую '
+            'реплику')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='Псевдоним реплики (по умолчанию все из DATABASE_REPLICAS)',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Повторять каждые столько секунд',
+        )
+
+    def handle(self, *args, **options):
+        source = settings.DATABASES['default']
+        if source['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Копирование поддерживается только для SQLite')
+        aliases = options['databases'] or settings.DATABASE_REPLICAS
+        while True:
+            for alias in aliases:
+                target = settings.DATABASES[alias]['NAME']
+                copy_database(source['NAME'], target)
+                self.stdout.write(f'Реплика {alias} обновлена')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+
+PRIMARY = 'default'
+PIN_COOKIE = 'read_primary'
+
+_state = threading.local()
+
+
+def replica_reads(view):
+    """Разрешает представлению читать с реплик.
+
+    Остальные представления, формы и команды читают основную базу.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_state, 'replica', False)
+        _state.replica = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _state.replica = previous
+    return wrapper
+
+
+def reading_replica():
+    """Текущее представление может читать с реплики."""
+    return bool(settings.DATABASE_REPLICAS) and getattr(
+        _state, 'replica', False
+    )
+
+
+def replica_cache_timeout(timeout):
+    """Время жизни кеша, который заполняется в представлении replica_reads.
+
+    Такие записи могли прочитать отстающую реплику и лечь под ключ
+    уже нового поколения, поэтому живут не дольше REPLICA_PIN_SECONDS:
+    отставание не растягивается на всё время жизни кеша.
+    """
+    if not reading_replica():
+        return timeout
+    if timeout is None:
+        return settings.REPLICA_PIN_SECONDS
+    return min(timeout, settings.REPLICA_PIN_SECONDS)
+
+
+def replica_epoch():
+    """Номер окна REPLICA_PIN_SECONDS для валидаторов страниц,
+    отрисованных с реплики; без реплик — пустая строка."""
+    if not reading_replica():
+        return ''
+    return str(int(time.time() // settings.REPLICA_PIN_SECONDS))
+
+
+class PrimaryReplicaRouter:
+    """Запись — в основную базу, чтение представлений replica_reads —
+    со случайной реплики из DATABASE_REPLICAS.
+
+    После записи чтение до конца запроса идёт из основной базы,
+    а ReadYourWritesMiddleware продлевает это на следующие запросы,
+    пока реплика не догонит основную базу.
+    """
+
+    # Сессии и ключи миниатюр sorl читаются из основной базы: только
+    # что созданной записи на реплике ещё может не быть, а sorl кеширует
+    # и отсутствие ключа.
+    primary_apps = {'sessions', 'thumbnail'}
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (
+            replicas
+            and model._meta.app_label not in self.primary_apps
+            and getattr(_state, 'replica', False)
+            and not getattr(_state, 'pinned', False)
+        ):
+            return random.choice(replicas)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        _state.pinned = _state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики получают схему вместе с копией основной базы.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """Пользователь, который только что что-то записал, читает основную
+    базу REPLICA_PIN_SECONDS секунд: так он видит свой комментарий
+    после редиректа, даже если реплика ещё не обновилась."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.pinned = PIN_COOKIE in request.COOKIES
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote, _state.pinned, _state.wrote = _state.wrote, False, False
+        if wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
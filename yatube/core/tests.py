@@ -1,4 +1,23 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from http import HTTPStatus
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.http import http_date
+
+from core.routers import (PIN_COOKIE, replica_cache_timeout,
+                          replica_reads)
+from posts.models import Post, User
+from posts.timeline import load_recent_posts
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
 class ViewTestClass(TestCase):
@@ -8,3 +27,155 @@ class ViewTestClass(TestCase):
         self.assertEqual(response.status_code, 404)
         # Проверьте, что используется шаблон core/404.html
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.content = bytes(range(256)) * 4
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'posts'))
+        cls.path = os.path.join(TEMP_MEDIA_ROOT, 'posts', 'file.gif')
+        with open(cls.path, 'wb') as file:
+            file.write(cls.content)
+        cls.url = settings.MEDIA_URL + 'posts/file.gif'
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_file_is_served(self):
+        """Файл отдаётся целиком с заголовками кеширования"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(
+            self.client.get(settings.MEDIA_URL + '../manage.py').status_code,
+            HTTPStatus.NOT_FOUND
+        )
+
+    def test_range_requests(self):
+        """Запрос части файла"""
+        cases = (
+            ('bytes=10-19', 10, 19),
+            ('bytes=1000-', 1000, 1023),
+            ('bytes=-4', 1020, 1023),
+            ('bytes=1020-5000', 1020, 1023),
+        )
+        for header, start, end in cases:
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.PARTIAL_CONTENT)
+                self.assertEqual(
+                    b''.join(response.streaming_content),
+                    self.content[start:end + 1]
+                )
+                self.assertEqual(response['Content-Range'],
+                                 f'bytes {start}-{end}/1024')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code,
+                         HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_not_modified(self):
+        """If-Modified-Since отвечает 304 для неизменённого файла"""
+        response = self.client.get(
+            self.url,
+            HTTP_IF_MODIFIED_SINCE=http_date(os.path.getmtime(self.path))
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect')
+    def test_accel_redirect(self):
+        """С nginx отдаётся только заголовок X-Accel-Redirect"""
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-media/posts/file.gif')
+        self.assertEqual(response.content, b'')
+
+
+class SqlitePragmasTest(TestCase):
+    def test_pragmas_applied_on_connect(self):
+        """Новое соединение получает настройки SQLITE_PRAGMAS"""
+        with connection.cursor() as cursor:
+            for name, expected in (
+                ('synchronous', 1),
+                ('temp_store', 2),
+                ('busy_timeout', settings.SQLITE_PRAGMAS['busy_timeout']),
+                ('cache_size', settings.SQLITE_PRAGMAS['cache_size']),
+            ):
+                with self.subTest(name=name):
+                    cursor.execute(f'PRAGMA {name}')
+                    self.assertEqual(cursor.fetchone()[0], expected)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_sqlite', seconds=0.1, stdout=out)
+        self.assertIn('SQLITE_PRAGMAS: чтений/с', out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(TransactionTestCase):
+    # В тестах реплика — зеркало основной базы в памяти. Транзакция
+    # TestCase заблокировала бы её таблицы для второго соединения.
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader')
+        self.post = Post.objects.create(text='Пост', author=self.user)
+        self.client.force_login(self.user)
+
+    def get_queries(self, method, url, **kwargs):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            with CaptureQueriesContext(connections['default']) as primary:
+                response = getattr(self.client, method)(url, **kwargs)
+        return response, primary.captured_queries, replica.captured_queries
+
+    def test_feeds_read_from_replica(self):
+        """Ленты читают реплику, формы и сессии — основную базу"""
+        _, primary, replica = self.get_queries(
+            'get', reverse('posts:profile', args=(self.user.username,)))
+        self.assertTrue(any('posts_post' in q['sql'] for q in replica))
+        self.assertFalse(any('posts_post' in q['sql'] for q in primary))
+        self.assertTrue(any('django_session' in q['sql'] for q in primary))
+        _, _, replica = self.get_queries('get', reverse('posts:post_create'))
+        self.assertEqual(replica, [])
+
+    def test_reads_after_write_use_primary(self):
+        """После записи пользователь читает основную базу"""
+        response, _, _ = self.get_queries(
+            'post', reverse('posts:add_comment', args=(self.post.pk,)),
+            data={'text': 'Комментарий'},
+        )
+        self.assertIn(PIN_COOKIE, response.cookies)
+        _, primary, replica = self.get_queries(
+            'get', reverse('posts:post_detail', args=(self.post.pk,)))
+        self.assertEqual(replica, [])
+        self.assertTrue(any('posts_comment' in q['sql'] for q in primary))
+        self.client.cookies.pop(PIN_COOKIE)
+        _, _, replica = self.get_queries(
+            'get', reverse('posts:post_detail', args=(self.post.pk,)))
+        self.assertTrue(any('posts_comment' in q['sql'] for q in replica))
+
+    def test_caches_filled_from_replica_expire(self):
+        """Кеш, заполненный с реплики, живёт не дольше REPLICA_PIN_SECONDS"""
+        pin = settings.REPLICA_PIN_SECONDS
+        timeouts = replica_reads(
+            lambda: [replica_cache_timeout(t) for t in (None, pin * 10, 1)]
+        )
+        self.assertEqual(timeouts(), [pin, pin, 1])
+        self.assertIsNone(replica_cache_timeout(None))
+
+    def test_permanent_caches_read_primary(self):
+        """Бессрочный список свежих постов читается из основной базы"""
+        with CaptureQueriesContext(connections['replica']) as replica:
+            recent = replica_reads(load_recent_posts)(self.user.pk)
+        self.assertEqual([pk for _, pk in recent], [self.post.pk])
+        self.assertEqual(replica.captured_queries, [])
@@ -1,4 +1,19 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified)
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
 
 
 def page_not_found(request, exception):
@@ -17,3 +32,136 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+class FileRange:
+    """Диапазон байтов открытого файла для FileResponse.
+
+    read() не выходит за конец диапазона, а fileno() позволяет серверу
+    с wsgi.file_wrapper отдать диапазон через sendfile: он начинает
+    с текущей позиции файла и берёт Content-Length байтов.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """Пара (начало, длина) для заголовка Range с одним диапазоном.
+
+    None — заголовок не разобран или диапазонов несколько: тогда
+    отдаётся весь файл. ValueError — диапазон вне файла.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    start, end = match.groups()
+    if start == '':
+        length = min(int(end), size)
+        if not length:
+            raise ValueError(header)
+        return size - length, length
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end - start + 1
+
+
+def media_cache_control(path):
+    # Имена картинок и миниатюр зависят от содержимого: файл под таким
+    # именем не меняется, и браузер может не перепроверять его.
+    if path.startswith(settings.MEDIA_IMMUTABLE_PREFIXES):
+        return 'public, max-age=31536000, immutable'
+    return f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+@require_safe
+def media(request, path):
+    """Отдаёт загруженные файлы, если перед приложением нет веб-сервера.
+
+    Поддерживает Range и If-Modified-Since. С MEDIA_SENDFILE
+    'x-accel-redirect' или 'x-sendfile' сам файл отдаёт nginx или
+    Apache по заголовку ответа.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Файл не найден')
+    if not os.path.isfile(full_path):
+        raise Http404('Файл не найден')
+    if not was_modified_since(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'),
+        stat.st_mtime, stat.st_size
+    ):
+        return HttpResponseNotModified()
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    last_modified = http_date(stat.st_mtime)
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(
+            settings.MEDIA_ACCEL_REDIRECT_PREFIX + path
+        )
+    elif settings.MEDIA_SENDFILE == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = file_response(request, full_path, stat.st_size,
+                                 content_type, last_modified)
+    response['Last-Modified'] = last_modified
+    response['Cache-Control'] = media_cache_control(path)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def file_response(request, full_path, size, content_type, last_modified):
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # If-Range с другой датой: у клиента старая версия, отдаём весь файл.
+    if range_header and if_range and (
+        parse_http_date_safe(if_range) != parse_http_date_safe(last_modified)
+    ):
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size) if range_header else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, length = byte_range
+        response = FileResponse(
+            FileRange(file, start, length),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Length'] = length
+        response['Content-Range'] = (
+            f'bytes {start}-{start + length - 1}/{size}'
+        )
+    response['Accept-Ranges'] = 'bytes'
+    return response
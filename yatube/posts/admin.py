@@ -1,21 +1,134 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db.models import Q
+from django.template.defaultfilters import filesizeformat
 
-from .models import Comment, Follow, Group, Post
+from .autocomplete import ADMIN_SEARCH_LIMIT, GROUP, USER, search_ids
+from .models import Comment, Follow, Group, Post, User
+from .search import filter_posts, search_supported
+from .utils import CachedCountPaginator
 
 
-class PostAdmin(admin.ModelAdmin):
+def index_search_ids(request, query, kind):
+    """id для поиска в админке по префиксному индексу.
+
+    Если совпадений больше ADMIN_SEARCH_LIMIT, список показывает первые
+    из них и просит уточнить запрос, а не обрезает выдачу молча.
+    """
+    ids = search_ids(query, kind, ADMIN_SEARCH_LIMIT + 1)
+    if len(ids) <= ADMIN_SEARCH_LIMIT:
+        return ids
+    # Подсказки полей автодополнения листаются сами, сообщение
+    # для них попало бы на следующую страницу админки.
+    if request.resolver_match.url_name != 'autocomplete':
+        messages.warning(
+            request,
+            f'По запросу «{query}» найдено больше {ADMIN_SEARCH_LIMIT} '
+            f'совпадений, показаны первые {ADMIN_SEARCH_LIMIT}. '
+            f'Уточните запрос.'
+        )
+    return ids[:ADMIN_SEARCH_LIMIT]
+
+
+def user_search_ids(request, query):
+    """id пользователей по началу имени или пустой список, если искать
+    надо обычным поиском: почту и часть слова индекс не знает."""
+    if not query or '@' in query:
+        return []
+    return index_search_ids(request, query, USER)
+
+
+class AdminPaginator(CachedCountPaginator):
+    """Количество строк списка в админке без COUNT(*) на каждый запрос."""
+    count_scopes = ('posts', 'follows', 'comments')
+
+
+class LoadedAutocompleteSelect(AutocompleteSelect):
+    """Поле автодополнения, которое берёт подпись выбранного значения
+    из уже загруженного объекта, а не из отдельного запроса."""
+    loaded = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = {str(v) for v in value if v not in (None, '')}
+        if self.loaded is None or selected != {str(self.loaded.pk)}:
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(
+            name, self.loaded.pk,
+            self.choices.field.label_from_instance(self.loaded),
+            True, len(options),
+        ))
+        return [(None, options, 0)]
+
+
+class ChangelistForm(forms.ModelForm):
+    """Форма строки списка: связанные объекты уже загружены через
+    list_select_related и передаются полям автодополнения."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name, field in self.fields.items():
+            widget = getattr(field.widget, 'widget', field.widget)
+            if isinstance(widget, LoadedAutocompleteSelect):
+                widget.loaded = getattr(self.instance, name, None)
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Список для больших таблиц: без полного подсчёта строк,
+    с кешированным количеством для пагинации и без запроса на каждую
+    строку для редактируемых связей."""
+    paginator = AdminPaginator
+    show_full_result_count = False
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.get_autocomplete_fields(request):
+            kwargs.setdefault('widget', LoadedAutocompleteSelect(
+                db_field.remote_field, self.admin_site,
+                using=kwargs.get('using'),
+            ))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_changelist_form(self, request, **kwargs):
+        kwargs.setdefault('form', ChangelistForm)
+        return super().get_changelist_form(request, **kwargs)
+
+
+class PostAdmin(ScalableAdmin):
     list_display = ('pk',
                     'text',
                     'pub_date',
                     'author',
                     'group',
                     'image',
+                    'image_dimensions',
                     )
     list_editable = ('group', 'image',)
+    list_select_related = ('author', 'group',)
+    autocomplete_fields = ('author', 'group',)
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по тексту идёт по индексу FTS5, а не LIKE по всей таблице.
+        if not search_supported():
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return filter_posts(queryset, search_term), False
+
+    def image_dimensions(self, post):
+        if post.image_width is None:
+            return None
+        return (f'{post.image_width}×{post.image_height}, '
+                f'{filesizeformat(post.image_size)}')
+    image_dimensions.short_description = 'Размеры картинки'
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('id',
@@ -29,20 +142,55 @@ class GroupAdmin(admin.ModelAdmin):
     search_fields = ('title',)
     list_filter = ('title',)
 
+    def get_search_results(self, request, queryset, search_term):
+        # Префиксный индекс подсказок вместо icontains по всей таблице.
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            pk__in=index_search_ids(request, search_term, GROUP)
+        ), False
 
-class CommentAdmin(admin.ModelAdmin):
+
+class CommentAdmin(ScalableAdmin):
     list_display = ('post', 'author', 'text', 'created',)
-    list_filter = ('text', 'created',)
-    search_fields = ('post', 'author', 'text',)
+    list_select_related = ('post', 'author',)
+    autocomplete_fields = ('post', 'author',)
+    search_fields = ('text',)
+    date_hierarchy = 'created'
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(ScalableAdmin):
     list_display = ('user', 'author',)
-    list_filter = ('user', 'author',)
-    search_fields = ('user', 'author',)
+    list_select_related = ('user', 'author',)
+    search_fields = ('user__username', 'author__username',)
+    autocomplete_fields = ('user', 'author',)
+
+    def get_search_results(self, request, queryset, search_term):
+        users = user_search_ids(request, search_term)
+        if not users:
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return queryset.filter(
+            Q(user__in=users) | Q(author__in=users)
+        ), False
+
+
+class UserAdmin(BaseUserAdmin):
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по началу имени, как в подсказках шапки сайта.
+        users = user_search_ids(request, search_term)
+        if not users:
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return queryset.filter(pk__in=users), False
 
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.unregister(User)
+admin.site.register(User, UserAdmin)
@@ -0,0 +1,109 @@
+import threading
+from bisect import bisect_left
+
+from django.urls import reverse
+
+from .generations import get_generation
+from .models import Group, User
+
+AUTOCOMPLETE_SCOPE = 'autocomplete'
+AUTOCOMPLETE_LIMIT = 10
+# Столько id поиск в админке передаёт в pk__in; о лишних совпадениях
+# админка предупреждает.
+ADMIN_SEARCH_LIMIT = 500
+USER, GROUP = 'user', 'group'
+
+_lock = threading.Lock()
+_index = None
+
+
+def normalize(value):
+    return ' '.join(value.casefold().replace('ё', 'е').split())
+
+
+class PrefixIndex:
+    """Отсортированный список нормализованных ключей пользователей
+    и групп: префикс ищется двоичным поиском, без запросов к базе.
+
+    Неактивные пользователи тоже в индексе: админка должна их находить,
+    а подсказки на сайте их пропускают.
+    """
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.labels = {USER: {}, GROUP: {}}
+        self.inactive = set()
+        entries = set()
+        users = User.objects.values_list(
+            'pk', 'username', 'first_name', 'last_name', 'is_active'
+        )
+        for pk, username, first_name, last_name, active in users.iterator():
+            full_name = f'{first_name} {last_name}'.strip()
+            self.labels[USER][pk] = (username, full_name)
+            if not active:
+                self.inactive.add(pk)
+            for key in (username, first_name, last_name, full_name):
+                if key:
+                    entries.add((normalize(key), USER, pk))
+        groups = Group.objects.values_list('pk', 'title', 'slug')
+        for pk, title, slug in groups.iterator():
+            self.labels[GROUP][pk] = (slug, title)
+            for key in (title, slug):
+                entries.add((normalize(key), GROUP, pk))
+        self.entries = sorted(entries)
+        self.keys = [key for key, _, _ in self.entries]
+
+    def lookup(self, query, kinds=(USER, GROUP), limit=AUTOCOMPLETE_LIMIT,
+               active_only=False):
+        """Пары (тип, id) по префиксу в порядке ключей, без повторов."""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        found = {}
+        position = bisect_left(self.keys, prefix)
+        for position in range(position, len(self.entries)):
+            key, kind, pk = self.entries[position]
+            if not key.startswith(prefix) or len(found) >= limit:
+                break
+            if kind not in kinds:
+                continue
+            if active_only and kind == USER and pk in self.inactive:
+                continue
+            found.setdefault((kind, pk), None)
+        return list(found)
+
+
+def get_index():
+    """Индекс процесса; перестраивается, когда запись пользователя или
+    группы сменила поколение."""
+    global _index
+    generation = get_generation(AUTOCOMPLETE_SCOPE)
+    index = _index
+    if index is None or index.generation != generation:
+        with _lock:
+            if _index is None or _index.generation != generation:
+                _index = PrefixIndex(generation)
+            index = _index
+    return index
+
+
+def suggestions(query, limit=AUTOCOMPLETE_LIMIT):
+    """Подсказки для шапки сайта: подпись и ссылка на профиль или
+    группу."""
+    index = get_index()
+    results = []
+    for kind, pk in index.lookup(query, limit=limit, active_only=True):
+        name, title = index.labels[kind][pk]
+        if kind == USER:
+            label = f'{title} (@{name})' if title else name
+            url = reverse('posts:profile', args=(name,))
+        else:
+            label = title
+            url = reverse('posts:group_list', args=(name,))
+        results.append({'type': kind, 'label': label, 'url': url})
+    return results
+
+
+def search_ids(query, kind, limit=ADMIN_SEARCH_LIMIT):
+    """id пользователей или групп по префиксу для поиска в админке."""
+    return [pk for _, pk in get_index().lookup(query, (kind,), limit)]
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from core.routers import replica_cache_timeout
+
+from . import thumbnails
+
+CARD_KEY = 'posts:card:{}:{}:{}{}'
+CARD_TEMPLATE = 'posts/includes/post_template.html'
+
+
+def card_key(post, author=False, group=False):
+    """Ключ карточки: id поста, время изменения и вариант шаблона."""
+    return CARD_KEY.format(
+        post.pk, post.updated.timestamp(), int(author), int(group)
+    )
+
+
+def render_cards(posts, author=False, group=False):
+    """HTML карточек страницы: одно чтение кеша на всю страницу."""
+    keys = {card_key(post, author, group): post for post in posts}
+    cards = cache.get_many(keys)
+    stale = {key: post for key, post in keys.items() if key not in cards}
+    thumbnails.prefetch_thumbnails(stale.values(), 'card')
+    missing = {
+        key: render_to_string(
+            CARD_TEMPLATE, {'post': post, 'author': author, 'group': group}
+        )
+        for key, post in stale.items()
+    }
+    if missing:
+        cache.set_many(
+            missing, replica_cache_timeout(settings.CARD_CACHE_TIMEOUT)
+        )
+        cards.update(missing)
+    return [cards[key] for key in keys]
+
+
+def drop_cards(post):
+    cache.delete_many(
+        card_key(post, author, group)
+        for author in (False, True)
+        for group in (False, True)
+    )
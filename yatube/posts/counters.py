@@ -0,0 +1,68 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Follow, Post, Profile, User
+
+
+def change_user_counter(user_id, field, delta):
+    """Атомарно меняет счётчик пользователя через F-выражение."""
+    updated = Profile.objects.filter(user_id=user_id).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+    # Профиль создаётся только при росте счётчика: при удалении
+    # пользователя его профиль уже удалён и воскрешать его нельзя.
+    if not updated and delta > 0:
+        recount_users(Profile.objects.get_or_create(user_id=user_id)[0].pk)
+
+
+def change_comments_counter(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=Greatest(F('comments_count') + delta, 0)
+    )
+
+
+def count_subquery(queryset, field, outer_field='pk'):
+    """Подзапрос COUNT(*) по связанной таблице для UPDATE ... SET."""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef(outer_field)})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def recount_users(*profile_ids):
+    """Пересчитывает счётчики профилей (всех, если не переданы id)."""
+    profiles = Profile.objects.all()
+    if profile_ids:
+        profiles = profiles.filter(pk__in=profile_ids)
+    return profiles.update(
+        posts_count=count_subquery(Post.objects.all(), 'author', 'user_id'),
+        followers_count=count_subquery(
+            Follow.objects.all(), 'author', 'user_id'
+        ),
+        following_count=count_subquery(
+            Follow.objects.all(), 'user', 'user_id'
+        ),
+    )
+
+
+def recount_all():
+    """Создаёт недостающие профили и пересчитывает все счётчики."""
+    Profile.objects.bulk_create(
+        (
+            Profile(user_id=user_id)
+            for user_id in User.objects.filter(profile__isnull=True)
+            .values_list('pk', flat=True).iterator()
+        ),
+        batch_size=500,
+    )
+    recount_users()
+    Post.objects.update(
+        comments_count=count_subquery(Comment.objects.all(), 'post')
+    )
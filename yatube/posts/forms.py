@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from .images import prepare_image
 from .models import Post, Comment
 
 
@@ -19,6 +21,13 @@ class PostForm(forms.ModelForm):
             'image': 'Картинка'
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # При редактировании без новой загрузки здесь уже сохранённый файл.
+        if isinstance(image, UploadedFile):
+            return prepare_image(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
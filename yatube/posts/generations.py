@@ -0,0 +1,61 @@
+import time
+
+from django.core.cache import cache
+
+GENERATION_KEY = 'posts:generation:{}'
+
+
+def generation_key(scope):
+    return GENERATION_KEY.format(scope)
+
+
+def get_generations(*scopes):
+    """Текущие поколения данных областей кеширования одним запросом.
+
+    Поколение — время последнего изменения области в наносекундах.
+    Поэтому после вытеснения счётчика из кеша новое значение не совпадёт
+    с поколением, под которым ещё лежат старые записи, а по поколению
+    можно выставить заголовок Last-Modified.
+    """
+    keys = [generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return tuple(found[key] for key in keys)
+
+
+def get_generation(scope):
+    return get_generations(scope)[0]
+
+
+def bump_generation(*scopes):
+    """Делает устаревшими все ключи, построенные на этих поколениях."""
+    for scope in scopes:
+        key = generation_key(scope)
+        # При гонке двух записей останется одно из новых значений: оба
+        # больше прежнего, и старые ключи в любом случае станут мёртвыми.
+        cache.set(key, max(time.time_ns(), (cache.get(key) or 0) + 1), None)
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def author_scope(author_id):
+    return f'author:{author_id}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def post_scopes(post, group_id=None):
+    """Области, которые затрагивает запись поста: общая лента, лента
+    автора и ленты старой и новой группы."""
+    scopes = {'posts', author_scope(post.author_id), post_scope(post.pk)}
+    for pk in (post.group_id, group_id):
+        if pk is not None:
+            scopes.add(group_scope(pk))
+    return scopes
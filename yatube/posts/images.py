@@ -0,0 +1,146 @@
+import base64
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+from sorl.thumbnail import delete as delete_thumbnails
+
+from .generations import bump_generation, post_scopes
+from .models import Post
+from .page_cache import purge_all_pages
+
+EXIF_ORIENTATION = 0x0112
+BATCH_SIZE = 500
+# Заглушка в пропорциях карточки: около 400 байт в разметке.
+PLACEHOLDER_SIZE = (24, 8)
+PLACEHOLDER_QUALITY = 50
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 90, 'optimize': True},
+    'WEBP': {'quality': 90},
+    'PNG': {'optimize': True},
+}
+
+
+def prepare_image(upload):
+    """Проверяет загруженную картинку и при необходимости уменьшает её.
+
+    Размеры читаются из заголовка файла до декодирования, поэтому
+    картинка-бомба отклоняется, не занимая память. Большие картинки
+    уменьшаются до POST_IMAGE_MAX_SIZE по длинной стороне: JPEG
+    декодируется сразу в уменьшенном масштабе (draft), остальные
+    форматы сначала сжимаются в целое число раз (reduce). Поворот
+    из EXIF применяется к пикселям. Подходящие файлы сохраняются
+    как есть, без перекодирования.
+    """
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Картинка слишком большая: не больше %(limit)s мегапикселей.',
+            code='too_many_pixels',
+            params={'limit': settings.POST_IMAGE_MAX_PIXELS // 10 ** 6},
+        )
+    max_size = settings.POST_IMAGE_MAX_SIZE
+    orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+    # Анимацию при пересохранении потеряли бы: такие файлы не трогаем.
+    # MPO телефонов тоже многокадровый, но это фотография с превью:
+    # её уменьшаем и сохраняем первым кадром, обычным JPEG.
+    animated = getattr(image, 'is_animated', False) and image.format != 'MPO'
+    if animated or (max(width, height) <= max_size and orientation == 1):
+        upload.seek(0)
+        return upload
+    image_format = 'JPEG' if image.format == 'MPO' else image.format
+    image.thumbnail((max_size, max_size), Image.LANCZOS, reducing_gap=2.0)
+    image = ImageOps.exif_transpose(image)
+    content = BytesIO()
+    image.save(content, image_format, **SAVE_OPTIONS.get(image_format, {}))
+    return SimpleUploadedFile(
+        upload.name, content.getvalue(), Image.MIME.get(image_format)
+    )
+
+
+def make_placeholder(file):
+    """Превью картинки размером PLACEHOLDER_SIZE в виде data URI.
+
+    Браузер растягивает его фоном под миниатюрой, поэтому страница
+    выглядит готовой до загрузки картинок. JPEG декодируется сразу
+    в уменьшенном масштабе (draft).
+    """
+    with Image.open(file) as image:
+        image.draft('RGB', PLACEHOLDER_SIZE)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image = ImageOps.fit(image, PLACEHOLDER_SIZE, Image.BILINEAR)
+    content = BytesIO()
+    image.save(content, 'JPEG', quality=PLACEHOLDER_QUALITY, optimize=True)
+    return 'data:image/jpeg;base64,' + base64.b64encode(
+        content.getvalue()
+    ).decode()
+
+
+def release_image(name, min_age=None):
+    """Удаляет картинку и её миниатюры, если на неё больше не ссылается
+    ни один пост: одинаковые загрузки хранятся одним файлом.
+
+    Файл, загруженный позже min_age секунд назад, не удаляется: ту же
+    картинку мог загрузить пост, транзакция которого ещё не завершена.
+    Такие файлы потом убирает collect_media.
+    """
+    if not name or Post.objects.filter(image=name).exists():
+        return
+    if min_age is None:
+        min_age = settings.MEDIA_GC_MIN_AGE
+    field = Post._meta.get_field('image')
+    border = timezone.now() - timedelta(seconds=min_age)
+    try:
+        if field.storage.get_modified_time(name) > border:
+            return
+        delete_thumbnails(field.attr_class(None, field, name))
+    except (OSError, SuspiciousFileOperation):
+        # Файла уже нет или путь вне MEDIA_ROOT: удалять нечего.
+        pass
+
+
+def fill_image_dimensions():
+    """Заполняет ширину, высоту и размер картинок старых постов.
+
+    Pillow читает только заголовок файла. Возвращает число заполненных
+    постов и постов, чьих файлов нет в хранилище.
+    """
+    pks = list(Post.objects.exclude(image='').filter(
+        Q(image_width=None) | Q(image_height=None) | Q(image_size=None)
+    ).values_list('pk', flat=True))
+    filled, missing, scopes = 0, 0, set()
+    for start in range(0, len(pks), BATCH_SIZE):
+        batch = []
+        for post in Post.objects.filter(
+            pk__in=pks[start:start + BATCH_SIZE]
+        ).only('pk', 'image', 'author_id', 'group_id'):
+            try:
+                with post.image.open() as file, Image.open(file) as image:
+                    post.image_width, post.image_height = image.size
+                post.image_size = post.image.size
+            except (OSError, SuspiciousFileOperation):
+                missing += 1
+                continue
+            # Карточки кешируются по времени изменения поста.
+            post.updated = timezone.now()
+            batch.append(post)
+            scopes |= post_scopes(post)
+        filled += save_dimensions(batch)
+    if filled:
+        bump_generation(*scopes)
+        purge_all_pages()
+    return filled, missing
+
+
+def save_dimensions(posts):
+    Post.objects.bulk_update(
+        posts, ('image_width', 'image_height', 'image_size', 'updated')
+    )
+    return len(posts)
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from posts.media_gc import collect_garbage
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки и миниатюры, на которые не ссылается ни один '
+            'пост, и устаревшие ключи миниатюр. Можно запускать по cron')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено',
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=settings.MEDIA_GC_MIN_AGE,
+            help='Не трогать файлы моложе стольких секунд',
+        )
+
+    def handle(self, *args, **options):
+        files, size, keys = collect_garbage(
+            dry_run=options['dry_run'], min_age=options['min_age']
+        )
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(
+            f'{verb}: файлов {files} ({filesizeformat(size)}), '
+            f'ключей миниатюр {keys}'
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import fill_image_dimensions
+
+
+class Command(BaseCommand):
+    help = 'Заполняет размеры картинок постов, загруженных до их учёта'
+
+    def handle(self, *args, **options):
+        filled, missing = fill_image_dimensions()
+        self.stdout.write(
+            f'Заполнены размеры картинок: {filled}, файлов не найдено: '
+            f'{missing}'
+        )
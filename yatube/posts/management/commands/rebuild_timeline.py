@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок'
+
+    def handle(self, *args, **options):
+        count = timeline.rebuild()
+        self.stdout.write(f'Записей в лентах подписок: {count}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов, подписок и комментариев'
+
+    def handle(self, *args, **options):
+        counters.recount_all()
+        self.stdout.write('Счётчики пересчитаны')
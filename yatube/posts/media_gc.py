@@ -0,0 +1,207 @@
+import os
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from .models import Post
+from .thumbnails import THUMBNAILS, thumbnail_file, thumbnail_variants
+
+BATCH_SIZE = 500
+
+
+def walk(storage, path):
+    """Имена всех файлов каталога хранилища, без загрузки списка целиком."""
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name).replace('\\', '/')
+    for directory in directories:
+        yield from walk(storage, os.path.join(path, directory))
+
+
+def batches(iterable):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def kv_records(identity):
+    """Записи KV-хранилища sorl пачками по ключу: удаление записей
+    между пачками не сбивает обход."""
+    prefix = add_prefix('', identity)
+    last = ''
+    while True:
+        batch = list(
+            KVStoreModel.objects.filter(key__startswith=prefix, key__gt=last)
+            .order_by('key').values_list('key', 'value')[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        last = batch[-1][0]
+        yield batch
+
+
+def live_images(names):
+    """Имена из пачки, на которые ссылаются посты, с шириной картинки."""
+    return dict(
+        Post.objects.filter(image__in=names).values_list(
+            'image', 'image_width'
+        )
+    )
+
+
+def expected_thumbnails(name, width):
+    """Ключи всех миниатюр, которые выводят шаблоны для картинки."""
+    field = Post._meta.get_field('image')
+    image = field.attr_class(None, field, name)
+    return {
+        thumbnail_file(image, geometry, image_format).key
+        for size in THUMBNAILS
+        for geometry, image_format in thumbnail_variants(size, width)
+    }
+
+
+class Sweep:
+    """Считает удаляемые файлы и ключи; без dry_run удаляет их."""
+
+    def __init__(self, dry_run, min_age):
+        self.dry_run = dry_run
+        self.border = timezone.now() - timedelta(seconds=min_age)
+        self.files = self.size = self.keys = 0
+
+    def is_young(self, storage, name):
+        # Файл моложе min_age мог загрузить пост, который ещё
+        # не сохранился.
+        try:
+            return storage.get_modified_time(name) > self.border
+        except OSError:
+            return False
+
+    def delete_file(self, storage, name):
+        try:
+            size = storage.size(name)
+        except OSError:
+            return
+        self.files += 1
+        self.size += size
+        if not self.dry_run:
+            storage.delete(name)
+
+    def delete_keys(self, *keys):
+        self.keys += len(keys)
+        if keys and not self.dry_run:
+            default.kvstore._delete_raw(*keys)
+
+    def drop_thumbnails(self, source, keep=()):
+        """Удаляет миниатюры картинки, кроме keep, и правит их список."""
+        kvstore = default.kvstore
+        keys = kvstore._get(source.key, identity='thumbnails') or []
+        stale = [key for key in keys if key not in keep]
+        for key in stale:
+            thumbnail = kvstore._get(key)
+            if thumbnail is not None:
+                self.delete_file(thumbnail.storage, thumbnail.name)
+            self.delete_keys(add_prefix(key))
+        if not stale or self.dry_run:
+            return
+        remaining = [key for key in keys if key not in stale]
+        if remaining:
+            kvstore._set(source.key, remaining, identity='thumbnails')
+        else:
+            kvstore._delete(source.key, identity='thumbnails')
+
+    def sweep_images(self):
+        """Картинки постов, на которые не ссылается ни один пост."""
+        field = Post._meta.get_field('image')
+        storage = field.storage
+        if not storage.exists(field.upload_to):
+            return
+        for batch in batches(walk(storage, field.upload_to)):
+            live = live_images(batch)
+            for name in batch:
+                if name not in live and not self.is_young(storage, name):
+                    self.delete_file(storage, name)
+
+    def sweep_records(self):
+        """Записи sorl: миниатюры удалённых картинок, лишние размеры
+        живых картинок и ссылки на исчезнувшие файлы."""
+        for batch in kv_records('image'):
+            sources = {}
+            for key, value in batch:
+                image = deserialize_image_file(value)
+                if image.name.startswith(sorl_settings.THUMBNAIL_PREFIX):
+                    if not image.exists():
+                        self.delete_keys(key)
+                else:
+                    sources[key] = image
+            live = live_images([image.name for image in sources.values()])
+            for key, image in sources.items():
+                if image.name in live:
+                    width = live[image.name]
+                    self.drop_thumbnails(
+                        image, expected_thumbnails(image.name, width)
+                    )
+                elif not self.is_young(image.storage, image.name):
+                    self.drop_thumbnails(image)
+                    self.delete_keys(key)
+
+    def sweep_thumbnail_lists(self):
+        """Списки миниатюр, чья картинка уже удалена из KV-хранилища."""
+        image_prefix = add_prefix('', 'image')
+        thumbnails_prefix = add_prefix('', 'thumbnails')
+        for batch in kv_records('thumbnails'):
+            keys = {
+                key: image_prefix + key[len(thumbnails_prefix):]
+                for key, _ in batch
+            }
+            known = set(
+                KVStoreModel.objects.filter(
+                    key__in=keys.values()
+                ).values_list('key', flat=True)
+            )
+            for key, image_key in keys.items():
+                if image_key not in known:
+                    self.delete_keys(key)
+
+    def sweep_thumbnail_files(self):
+        """Файлы миниатюр, о которых не знает KV-хранилище."""
+        storage = default.storage
+        prefix = sorl_settings.THUMBNAIL_PREFIX
+        if not storage.exists(prefix):
+            return
+        for batch in batches(walk(storage, prefix)):
+            keys = {
+                add_prefix(ImageFile(name, storage).key): name
+                for name in batch
+            }
+            known = set(
+                KVStoreModel.objects.filter(
+                    key__in=keys
+                ).values_list('key', flat=True)
+            )
+            for key, name in keys.items():
+                if key not in known and not self.is_young(storage, name):
+                    self.delete_file(storage, name)
+
+
+def collect_garbage(dry_run=False, min_age=None):
+    """Удаляет лишние файлы и ключи, обходя хранилище и KV-хранилище
+    пачками по BATCH_SIZE и сверяя каждую пачку с базой; возвращает
+    число файлов, освобождаемых байтов и ключей."""
+    if min_age is None:
+        min_age = settings.MEDIA_GC_MIN_AGE
+    sweep = Sweep(dry_run, min_age)
+    sweep.sweep_images()
+    sweep.sweep_records()
+    sweep.sweep_thumbnail_lists()
+    sweep.sweep_thumbnail_files()
+    return sweep.files, sweep.size, sweep.keys
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Profile = apps.get_model('posts', 'Profile')
+    Post = apps.get_model('posts', 'Post')
+    users = User.objects.annotate(
+        posts_total=models.Count('posts', distinct=True),
+        followers_total=models.Count('following', distinct=True),
+        following_total=models.Count('follower', distinct=True),
+    )
+    Profile.objects.bulk_create(
+        (
+            Profile(
+                user_id=user.pk,
+                posts_count=user.posts_total,
+                followers_count=user.followers_total,
+                following_count=user.following_total,
+            )
+            for user in users.iterator()
+        ),
+        batch_size=500,
+    )
+    for post in Post.objects.annotate(
+        comments_total=models.Count('comments')
+    ).filter(comments_total__gt=0).iterator():
+        Post.objects.filter(pk=post.pk).update(
+            comments_count=post.comments_total
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментариев'),
+        ),
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Постов')),
+                ('followers_count', models.PositiveIntegerField(default=0, verbose_name='Подписчиков')),
+                ('following_count', models.PositiveIntegerField(default=0, verbose_name='Подписок')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Профиль',
+                'verbose_name_plural': 'Профили',
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, help_text='Крошечное превью в виде data URI', verbose_name='Заглушка картинки'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            [
+                """CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_search
+                USING fts5(
+                    text, content='posts_post', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )""",
+                """CREATE TRIGGER IF NOT EXISTS posts_post_search_insert
+                AFTER INSERT ON posts_post BEGIN
+                    INSERT INTO posts_post_search(rowid, text)
+                    VALUES (new.id, new.text);
+                END""",
+                """CREATE TRIGGER IF NOT EXISTS posts_post_search_delete
+                AFTER DELETE ON posts_post BEGIN
+                    INSERT INTO posts_post_search(posts_post_search, rowid,
+                                                  text)
+                    VALUES ('delete', old.id, old.text);
+                END""",
+                """CREATE TRIGGER IF NOT EXISTS posts_post_search_update
+                AFTER UPDATE OF text ON posts_post BEGIN
+                    INSERT INTO posts_post_search(posts_post_search, rowid,
+                                                  text)
+                    VALUES ('delete', old.id, old.text);
+                    INSERT INTO posts_post_search(rowid, text)
+                    VALUES (new.id, new.text);
+                END""",
+                """INSERT INTO posts_post_search(posts_post_search)
+                VALUES ('rebuild')""",
+            ],
+            [
+                'DROP TRIGGER IF EXISTS posts_post_search_insert',
+                'DROP TRIGGER IF EXISTS posts_post_search_delete',
+                'DROP TRIGGER IF EXISTS posts_post_search_update',
+                'DROP TABLE IF EXISTS posts_post_search',
+            ],
+        ),
+    ]
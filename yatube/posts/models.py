@@ -2,6 +2,8 @@ from django.contrib.auth import get_user_model
 from django.db import models
 from django.urls import reverse
 
+from .storage import content_storage
+
 User = get_user_model()
 
 
@@ -14,6 +16,10 @@ class Post(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации',
     )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+    )
     group = models.ForeignKey(
         'Group',
         on_delete=models.SET_NULL,
@@ -32,11 +38,55 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=content_storage,
+        db_index=True,
+        width_field='image_width',
+        height_field='image_height',
         blank=True
     )
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки',
+        null=True,
+        editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки',
+        null=True,
+        editable=False,
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер файла картинки',
+        null=True,
+        editable=False,
+    )
+    image_placeholder = models.TextField(
+        'Заглушка картинки',
+        blank=True,
+        editable=False,
+        help_text='Крошечное превью в виде data URI',
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Комментариев',
+    )
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(
+                fields=['-pub_date'],
+                name='post_pub_date'
+            ),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='post_author_pub_date'
+            ),
+            models.Index(
+                fields=['group', '-pub_date'],
+                name='post_group_pub_date'
+            ),
+        )
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
@@ -96,6 +146,16 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('-created',)
+        indexes = (
+            models.Index(
+                fields=['post', '-created'],
+                name='comment_post_created'
+            ),
+            models.Index(
+                fields=['-created'],
+                name='comment_created'
+            ),
+        )
         verbose_name_plural = 'Коментарии'
         verbose_name = 'Коментарий'
 
@@ -124,8 +184,82 @@ class Follow(models.Model):
                 name='subscription_unique'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user'
+            ),
+        )
         verbose_name_plural = 'Подписки'
         verbose_name = 'Подписка'
 
     def __str__(self):
         return f'{self.user} подписан на {self.author}'
+
+
+class Profile(models.Model):
+    """Счётчики пользователя, поддерживаемые при записи."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='profile',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Постов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчиков',
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписок',
+    )
+
+    class Meta:
+        verbose_name_plural = 'Профили'
+        verbose_name = 'Профиль'
+
+    def __str__(self):
+        return str(self.user)
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: строка на пару читатель-пост."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        ordering = ('-pub_date',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='timeline_unique'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=['user', '-pub_date', 'post'],
+                name='timeline_user_pub_date_post'
+            ),
+        )
+        verbose_name_plural = 'Ленты подписок'
+        verbose_name = 'Запись ленты подписок'
+
+    def __str__(self):
+        return f'{self.user}: {self.post}'
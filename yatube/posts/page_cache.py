@@ -0,0 +1,122 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.encoding import escape_uri_path
+from django.views.decorators.http import condition
+
+from core.routers import replica_cache_timeout, replica_epoch
+
+from .generations import bump_generation, get_generations
+
+PAGE_KEY = 'posts:page:{}:{}:{}'
+
+
+def page_scope(path):
+    return f'page:{path}'
+
+
+def page_generations(request):
+    """Общее поколение страниц и поколение пути; читаются раз на запрос.
+
+    request.path раскодирован, а purge_pages получает пути из reverse()
+    в виде URI, поэтому путь запроса кодируется так же: иначе страницы
+    профилей с кириллическими именами никогда не сбрасывались бы.
+    """
+    if not hasattr(request, '_page_generations'):
+        request._page_generations = get_generations(
+            'pages', page_scope(escape_uri_path(request.path))
+        )
+    return request._page_generations
+
+
+def page_key(request):
+    """Ключ ответа: общее поколение страниц, поколение пути и запрос."""
+    full_path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return PAGE_KEY.format(*page_generations(request), full_path)
+
+
+def page_etag(request, *args, **kwargs):
+    """ETag анонимной страницы: поколения и запрос. Для страниц
+    с реплики ETag меняется и с окном REPLICA_PIN_SECONDS, чтобы копия,
+    прочитанная до того, как реплика догнала запись, не жила вечно."""
+    generations = ':'.join(map(str, page_generations(request)))
+    return hashlib.md5(
+        f'{generations}:{request.get_full_path()}:{replica_epoch()}'.encode()
+    ).hexdigest()
+
+
+def is_anonymous_request(request):
+    """Запрос без cookie сессии: страница не содержит ни данных
+    пользователя, ни CSRF-токена."""
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES
+
+
+def conditional_page(view):
+    """Отвечает 304 на повторный запрос анонимной страницы.
+
+    Страницы вошедших пользователей содержат CSRF-токен, который
+    меняется при каждом входе, поэтому валидаторы для них не отдаются.
+    Last-Modified не отдаётся: с точностью до секунды он не отличил бы
+    запись, сделанную в ту же секунду, что и сохранённая копия.
+    """
+    conditional_view = condition(etag_func=page_etag)(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if is_anonymous_request(request):
+            return conditional_view(request, *args, **kwargs)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def cache_anonymous_page(view):
+    """Кеширует готовые ответы страницы для анонимных посетителей.
+
+    Запрос с cookie сессии считается запросом вошедшего пользователя
+    и всегда отрисовывается заново. Записи сбрасываются не по времени,
+    а через purge_pages при изменении постов и комментариев.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (
+            request.method not in ('GET', 'HEAD')
+            or not is_anonymous_request(request)
+            or not settings.ANONYMOUS_PAGE_CACHE_TIMEOUT
+        ):
+            return view(request, *args, **kwargs)
+        key = page_key(request)
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, response, replica_cache_timeout(
+                    settings.ANONYMOUS_PAGE_CACHE_TIMEOUT
+                ))
+        return response
+    return wrapper
+
+
+def purge_pages(*paths):
+    bump_generation(*(page_scope(path) for path in paths))
+
+
+def purge_all_pages():
+    bump_generation('pages')
+
+
+def post_page_paths(post, group_slugs=()):
+    """Страницы, на которых виден пост: его страница, профиль автора,
+    страницы групп и главная (со всеми её ?page=N)."""
+    return [
+        reverse('posts:main_page'),
+        reverse('posts:post_detail', args=(post.pk,)),
+        reverse('posts:profile', args=(post.author.username,)),
+        *(reverse('posts:group_list', args=(slug,)) for slug in group_slugs)
+    ]
+
+
+def purge_post_pages(post, group_slugs=()):
+    purge_pages(*post_page_paths(post, group_slugs))
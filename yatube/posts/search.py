@@ -0,0 +1,177 @@
+import base64
+import binascii
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .utils import KeysetPage
+
+QUANTITY_OF_POSTS = settings.QUANTITY_OF_POSTS
+SEARCH_TABLE = 'posts_post_search'
+# Не больше стольких слов запроса: длинные запросы дороги для FTS5.
+MAX_SEARCH_TERMS = 10
+SNIPPET_TOKENS = 24
+# Маркеры подсветки: текст поста экранируется уже с ними.
+MARK_START, MARK_END = '\x02', '\x03'
+
+# Индекс хранит только токены, текст берётся из posts_post (external
+# content). Триггеры, а не сигналы, ловят и QuerySet.update().
+SEARCH_INDEX_SQL = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        text, content='posts_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert
+        AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete
+        AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update
+        AFTER UPDATE OF text ON posts_post BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {SEARCH_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+)
+SEARCH_SQL = (
+    f'SELECT rowid, rank, snippet({SEARCH_TABLE}, 0, %s, %s, %s, %s) '
+    f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s{{}} '
+    f'ORDER BY rank, rowid LIMIT %s'
+)
+SEARCH_AFTER_SQL = ' AND (rank > %s OR (rank = %s AND rowid > %s))'
+
+
+def search_supported(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def install_search_index(using=connection):
+    """Создаёт индекс и триггеры, если их нет.
+
+    Django пересоздаёт таблицу SQLite при изменении полей, и триггеры
+    пропадают вместе со старой таблицей, поэтому вызывается и после
+    каждой миграции.
+    """
+    if (
+        not search_supported(using)
+        or Post._meta.db_table not in using.introspection.table_names()
+    ):
+        return
+    with using.cursor() as cursor:
+        for sql in SEARCH_INDEX_SQL:
+            cursor.execute(sql)
+
+
+def rebuild_search_index(using=connection):
+    if not search_supported(using):
+        return
+    with using.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"
+        )
+
+
+def match_expression(query):
+    """Запрос FTS5 из пользовательского ввода: все слова как префиксы.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 из ввода
+    не применяются. Пустая строка — искать нечего.
+    """
+    terms = re.findall(r'\w+', query)[:MAX_SEARCH_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def encode_search_cursor(rank, pk):
+    raw = f'{rank!r}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_search_cursor(token):
+    """Возвращает пару (rank, pk) или None для испорченного токена."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        rank, pk = raw.decode().split('|')
+        return float(rank), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def highlight(snippet):
+    return mark_safe(
+        escape(snippet)
+        .replace(MARK_START, '<mark>')
+        .replace(MARK_END, '</mark>')
+    )
+
+
+class SearchPage(KeysetPage):
+    """Страница результатов поиска: позиция — пара (rank, id)."""
+
+    def __init__(self, object_list, has_next, has_previous):
+        super().__init__(object_list, None, has_next, has_previous)
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            post = self.object_list[-1]
+            return encode_search_cursor(post.search_rank, post.pk)
+        return None
+
+    @property
+    def previous_cursor(self):
+        return None
+
+
+def search_posts(query, after=None, per_page=QUANTITY_OF_POSTS):
+    """Посты по релевантности (bm25) со сниппетами в post.snippet.
+
+    Страницы идут по ключу (rank, id): без OFFSET и без подсчёта
+    всех совпадений.
+    """
+    expression = match_expression(query)
+    if not expression or not search_supported():
+        return SearchPage([], False, False)
+    cursor = decode_search_cursor(after) if after else None
+    params = [MARK_START, MARK_END, '…', SNIPPET_TOKENS, expression]
+    where = ''
+    if cursor is not None:
+        rank, pk = cursor
+        where = SEARCH_AFTER_SQL
+        params += [rank, rank, pk]
+    with connection.cursor() as db:
+        db.execute(SEARCH_SQL.format(where), params + [per_page + 1])
+        rows = db.fetchall()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [pk for pk, _, _ in rows]
+    )
+    results = []
+    for pk, rank, snippet in rows:
+        # Пост мог удалиться между запросами.
+        if pk in posts:
+            post = posts[pk]
+            post.search_rank = rank
+            post.snippet = highlight(snippet)
+            results.append(post)
+    return SearchPage(results, has_next, cursor is not None)
+
+
+def filter_posts(queryset, query):
+    """Сужает выборку постов до совпадений из индекса (для админки)."""
+    expression = match_expression(query)
+    if not expression:
+        return queryset
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s',
+        (expression,),
+    ))
@@ -0,0 +1,217 @@
+from django.core.signals import request_finished, request_started
+from django.db import connections, transaction
+from django.db.models.signals import (post_delete, post_init, post_migrate,
+                                      post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+from django.urls import reverse
+from django.utils import timezone
+
+from . import counters, thumbnails, timeline
+from .autocomplete import AUTOCOMPLETE_SCOPE
+from .cards import drop_cards
+from .generations import (author_scope, bump_generation, group_scope,
+                          post_scope, post_scopes)
+from .images import release_image
+from .models import Comment, Follow, Group, Post, Profile, User
+from .page_cache import purge_all_pages, purge_pages, purge_post_pages
+from .search import install_search_index
+
+
+def group_slugs(*group_ids):
+    return Group.objects.filter(
+        pk__in=[pk for pk in group_ids if pk is not None]
+    ).values_list('slug', flat=True)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created:
+        Profile.objects.get_or_create(user=instance)
+
+
+# ImageField при создании поста из базы открывает файл, если поля
+# размеров пусты. Размеры заполняются при загрузке (post_saving) и командой
+# fill_image_dimensions, поэтому карточки лент файлы не читают.
+post_init.disconnect(
+    Post._meta.get_field('image').update_dimension_fields, sender=Post
+)
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, **kwargs):
+    # Запоминаем прежнюю группу: при переносе поста меняются обе ленты.
+    instance._old_group_id = instance._old_image = None
+    if instance.pk is not None:
+        instance._old_group_id, instance._old_image = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', 'image').first() or (None, None)
+    image = instance.image
+    if not image:
+        instance.image_width = instance.image_height = None
+        instance.image_size = None
+    elif not image._committed:
+        # Новая загрузка ещё в памяти: размеры читаются из неё.
+        image.field.update_dimension_fields(instance, force=True)
+        instance.image_size = image.size
+    if not image or image.name != instance._old_image:
+        # Заглушку новой картинки создаёт generate_thumbnails.
+        instance.image_placeholder = ''
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    old_group_id = getattr(instance, '_old_group_id', None)
+    slugs = list(group_slugs(instance.group_id, old_group_id))
+    bump_generation(*post_scopes(instance, old_group_id))
+    purge_post_pages(instance, slugs)
+    old_image = getattr(instance, '_old_image', None)
+    if instance.image and instance.image.name != old_image:
+        thumbnails.schedule_thumbnails(instance, slugs)
+    if old_image and old_image != instance.image.name:
+        transaction.on_commit(lambda: release_image(old_image))
+    if created:
+        counters.change_user_counter(instance.author_id, 'posts_count', 1)
+        timeline.fan_out(instance)
+        timeline.drop_recent_posts(instance.author_id)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    bump_generation(*post_scopes(instance))
+    purge_post_pages(instance, group_slugs(instance.group_id))
+    drop_cards(instance)
+    image = instance.image.name
+    if image:
+        transaction.on_commit(lambda: release_image(image))
+    counters.change_user_counter(instance.author_id, 'posts_count', -1)
+    timeline.drop_recent_posts(instance.author_id)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    # Комментарии не выводятся в лентах: меняется только страница поста.
+    bump_generation(post_scope(instance.post_id), 'comments')
+    purge_pages(reverse('posts:post_detail', args=(instance.post_id,)))
+    if created:
+        counters.change_comments_counter(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    bump_generation(post_scope(instance.post_id), 'comments')
+    purge_pages(reverse('posts:post_detail', args=(instance.post_id,)))
+    counters.change_comments_counter(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_counter(instance.user_id, 'following_count', 1)
+        counters.change_user_counter(
+            instance.author_id, 'followers_count', 1
+        )
+        timeline.backfill(instance.user_id, instance.author_id)
+        bump_generation('follows')
+        purge_follow_pages(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.change_user_counter(instance.user_id, 'following_count', -1)
+    counters.change_user_counter(instance.author_id, 'followers_count', -1)
+    timeline.prune(instance.user_id, instance.author_id)
+    bump_generation('follows')
+    purge_follow_pages(instance)
+
+
+def purge_follow_pages(follow):
+    # Счётчики подписок выводятся в профилях обоих пользователей.
+    purge_pages(*(
+        reverse('posts:profile', args=(username,))
+        for username in User.objects.filter(
+            pk__in=(follow.user_id, follow.author_id)
+        ).values_list('username', flat=True)
+    ))
+
+
+def feed_scopes(posts):
+    """Области лент профилей и групп, в которых выводятся посты."""
+    scopes = set()
+    for author_id, group_id in posts.values_list(
+        'author_id', 'group_id'
+    ).distinct():
+        scopes.add(author_scope(author_id))
+        if group_id is not None:
+            scopes.add(group_scope(group_id))
+    return scopes
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    # Название группы выводится в карточках всех лент, в том числе
+    # в профилях авторов её постов.
+    posts = Post.objects.filter(group=instance)
+    scopes = set() if created else feed_scopes(posts)
+    if not created:
+        posts.update(updated=timezone.now())
+    bump_generation(
+        'posts', group_scope(instance.pk), AUTOCOMPLETE_SCOPE, *scopes
+    )
+    purge_all_pages()
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # SET_NULL обнуляет группу без сигналов: обновляем карточки заранее.
+    posts = Post.objects.filter(group=instance)
+    scopes = feed_scopes(posts)
+    posts.update(updated=timezone.now())
+    bump_generation(
+        'posts', group_scope(instance.pk), AUTOCOMPLETE_SCOPE, *scopes
+    )
+    purge_all_pages()
+
+
+@receiver(post_save, sender=User)
+def author_saved(sender, instance, created, update_fields, **kwargs):
+    # Имя автора выводится в карточках; вход в систему меняет только
+    # last_login и карточки не трогает.
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    posts = Post.objects.filter(author=instance)
+    scopes = feed_scopes(posts)
+    posts.update(updated=timezone.now())
+    bump_generation('posts', author_scope(instance.pk), *scopes)
+    purge_all_pages()
+
+
+@receiver(post_save, sender=User)
+def user_autocomplete_saved(sender, instance, update_fields, **kwargs):
+    # Имена пользователей входят в индекс подсказок.
+    if update_fields != frozenset(('last_login',)):
+        bump_generation(AUTOCOMPLETE_SCOPE)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    bump_generation(AUTOCOMPLETE_SCOPE)
+
+
+@receiver(request_started)
+def request_started_handler(sender, **kwargs):
+    thumbnails.start_deferred()
+
+
+@receiver(request_finished)
+def request_finished_handler(sender, **kwargs):
+    # Сервер вызывает его после отправки ответа: миниатюры создаются
+    # вне времени ответа и загрузившему, и первому посетителю.
+    thumbnails.run_deferred()
+
+
+@receiver(post_migrate)
+def posts_migrated(sender, using, **kwargs):
+    # Пересоздание таблицы posts_post при миграции удаляет триггеры
+    # поискового индекса: возвращаем их.
+    if sender.label == 'posts':
+        install_search_index(connections[using])
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# mkstemp создаёт файл с правами 0600. FileSystemStorage без
+# FILE_UPLOAD_PERMISSIONS получает 0666 за вычетом umask, как и любой
+# os.open; umask читается один раз, пока потоков ещё нет.
+UMASK = os.umask(0)
+os.umask(UMASK)
+DEFAULT_FILE_MODE = 0o666 & ~UMASK
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла — хеш его содержимого.
+
+    Хеш считается при потоковой записи во временный файл. Если файл
+    с таким содержимым уже есть, новая копия не сохраняется и запись
+    ссылается на существующий файл, а вместе с ним и на готовые
+    миниатюры. Удалять файл можно, только когда на него не ссылается
+    ни один пост.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Окончательное имя зависит от содержимого и выбирается в _save.
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=full_directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            hexdigest = digest.hexdigest()
+            name = os.path.join(
+                directory, hexdigest[:2], hexdigest + extension
+            )
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                os.remove(temp_path)
+                # Свежее время изменения защищает файл от удаления,
+                # пока новый пост не сохранён (MEDIA_GC_MIN_AGE).
+                os.utime(full_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                # Иначе веб-сервер не прочитает оригинал (0600).
+                mode = self.file_permissions_mode
+                os.chmod(
+                    temp_path,
+                    DEFAULT_FILE_MODE if mode is None else mode
+                )
+                os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name.replace('\\', '/')
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,12 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page_obj):
+    """Номера страниц вокруг текущей; None обозначает пропуск."""
+    paginator = page_obj.paginator
+    if hasattr(paginator, 'get_page_window'):
+        return paginator.get_page_window(page_obj.number)
+    return paginator.page_range
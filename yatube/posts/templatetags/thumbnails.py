@@ -0,0 +1,11 @@
+from django import template
+
+from posts.thumbnails import ready_thumbnail
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_thumbnail(image, size):
+    """Готовая миниатюра или None, если она ещё создаётся."""
+    return ready_thumbnail(image, size)
@@ -1,12 +1,21 @@
+import hashlib
 from http import HTTPStatus
+from io import BytesIO, StringIO
+import os
 import shutil
 import tempfile
 
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
+from posts.forms import PostForm
+from posts.images import release_image
 from posts.models import Group, Comment, Post, User
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -75,7 +84,136 @@ class PostFormTests(TestCase):
         self.assertEqual(post.text, form_data['text'])
         self.assertEqual(post.author, self.user)
         self.assertEqual(post.group.id, form_data['group'])
-        self.assertEqual(post.image, 'posts/small.gif')
+        digest = hashlib.sha256(self.small_gif).hexdigest()
+        self.assertEqual(post.image, f'posts/{digest[:2]}/{digest}.gif')
+
+    @staticmethod
+    def get_jpeg(size, orientation=1):
+        image = Image.new('RGB', size, color=(255, 0, 0))
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        content = BytesIO()
+        image.save(content, 'JPEG', exif=exif)
+        return SimpleUploadedFile(
+            'photo.jpg', content.getvalue(), content_type='image/jpeg')
+
+    @override_settings(POST_IMAGE_MAX_SIZE=400)
+    def test_large_image_is_downscaled_and_rotated(self):
+        """Большая картинка уменьшается и поворачивается по EXIF"""
+        form = PostForm(
+            data={'text': 'Текст'},
+            files={'image': self.get_jpeg((1200, 300), orientation=6)},
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        image = Image.open(form.cleaned_data['image'])
+        self.assertEqual(image.size, (100, 400))
+        self.assertNotIn(0x0112, image.getexif())
+
+    @override_settings(POST_IMAGE_MAX_SIZE=400)
+    def test_mpo_photo_is_downscaled_and_rotated(self):
+        """Многокадровое фото MPO обрабатывается как обычный JPEG"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        content = BytesIO()
+        Image.new('RGB', (1200, 300), color=(255, 0, 0)).save(
+            content, 'MPO', save_all=True, exif=exif,
+            append_images=[Image.new('RGB', (1200, 300))],
+        )
+        form = PostForm(data={'text': 'Текст'}, files={
+            'image': SimpleUploadedFile(
+                'IMG_0001.jpg', content.getvalue(), content_type='image/jpeg'
+            ),
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        image = Image.open(form.cleaned_data['image'])
+        self.assertEqual((image.format, image.size), ('JPEG', (100, 400)))
+
+    def test_small_image_is_stored_as_is(self):
+        """Картинка в пределах лимитов не перекодируется"""
+        upload = self.get_jpeg((50, 50))
+        form = PostForm(data={'text': 'Текст'}, files={'image': upload})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertIs(form.cleaned_data['image'], upload)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=1000)
+    def test_image_pixel_limit(self):
+        """Картинка с лишними мегапикселями отклоняется"""
+        form = PostForm(
+            data={'text': 'Текст'},
+            files={'image': self.get_jpeg((50, 50))},
+        )
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+    def test_same_image_is_stored_once(self):
+        """Одинаковые загрузки хранятся одним файлом до последней ссылки"""
+        posts = [
+            Post.objects.create(
+                text='Пост с картинкой',
+                author=self.author,
+                image=SimpleUploadedFile(
+                    name=f'copy_{number}.gif',
+                    content=self.small_gif,
+                    content_type='image/gif'
+                ),
+            )
+            for number in range(2)
+        ]
+        name = posts[0].image.name
+        self.assertEqual(posts[1].image.name, name)
+        storage = posts[0].image.storage
+        self.assertEqual(
+            storage.listdir(os.path.dirname(name))[1],
+            [os.path.basename(name)]
+        )
+        posts[0].delete()
+        release_image(name, min_age=0)
+        self.assertTrue(storage.exists(name))
+        posts[1].delete()
+        release_image(name)
+        self.assertTrue(storage.exists(name), 'Свежий файл удалён')
+        release_image(name, min_age=0)
+        self.assertFalse(storage.exists(name))
+
+    def test_image_file_permissions(self):
+        """Права на оригинал такие же, как у FileSystemStorage"""
+        post = Post.objects.create(
+            text='Пост с картинкой',
+            author=self.author,
+            image=self.get_jpeg((10, 20)),
+        )
+        plain = FileSystemStorage(location=TEMP_MEDIA_ROOT)
+        name = plain.save('plain.gif', ContentFile(self.small_gif))
+        self.assertEqual(
+            os.stat(post.image.path).st_mode & 0o777,
+            os.stat(plain.path(name)).st_mode & 0o777,
+        )
+
+    def test_image_dimensions(self):
+        """Размеры картинки заполняются при загрузке и командой"""
+        post = Post.objects.create(
+            text='Пост с картинкой',
+            author=self.author,
+            image=SimpleUploadedFile(
+                name='small.gif',
+                content=self.small_gif,
+                content_type='image/gif'
+            ),
+        )
+        dimensions = (2, 1, len(self.small_gif))
+        post.refresh_from_db()
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_size),
+            dimensions
+        )
+        Post.objects.update(
+            image_width=None, image_height=None, image_size=None)
+        call_command('fill_image_dimensions', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_size),
+            dimensions
+        )
 
     def test_edit_post_form(self):
         '''Проверка формы редактирования записи'''
@@ -1,7 +1,10 @@
+from io import StringIO
+
 from django.conf import settings
+from django.core.management import call_command
 from django.test import TestCase
 
-from ..models import Group, Post, User
+from ..models import Comment, Follow, Group, Post, Profile, User
 
 LEN_OF_POSTS = settings.LEN_OF_POSTS
 
@@ -60,3 +63,51 @@ class PostModelTest(TestCase):
                 self.assertEqual(
                     self.post._meta.get_field(field).help_text,
                     expected_value, error_name)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='random_name')
+        cls.author = User.objects.create_user(username='random_author')
+
+    def assertCounters(self, user, posts, followers, following):
+        profile = Profile.objects.get(user=user)
+        self.assertEqual(
+            (profile.posts_count,
+             profile.followers_count,
+             profile.following_count),
+            (posts, followers, following)
+        )
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются вместе с постами, подписками и комментариями"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        Comment.objects.create(post=post, author=self.user, text='Текст')
+        self.assertCounters(self.author, 1, 1, 0)
+        self.assertCounters(self.user, 0, 0, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        post.comments.all().delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertCounters(self.user, 0, 0, 0)
+        post.delete()
+        self.assertCounters(self.author, 0, 0, 0)
+
+    def test_recount_command(self):
+        """Команда recount_counters восстанавливает счётчики"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Follow.objects.create(user=self.user, author=self.author)
+        Comment.objects.create(post=post, author=self.user, text='Текст')
+        Profile.objects.filter(user=self.user).delete()
+        Profile.objects.update(posts_count=10, followers_count=10)
+        Post.objects.update(comments_count=10)
+        call_command('recount_counters', stdout=StringIO())
+        self.assertCounters(self.author, 1, 1, 0)
+        self.assertCounters(self.user, 0, 0, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
@@ -1,21 +1,44 @@
+from http import HTTPStatus
+import os
 import shutil
 import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import get_thumbnail
 
-from ..models import Follow, Group, Post, User
+from ..models import Comment, Follow, Group, Post, TimelineEntry, User
+from posts.cards import render_cards
 from posts.forms import PostForm
+from posts.page_cache import post_page_paths
+from posts.thumbnails import (MODERN_FORMATS, QUEUED_KEY, generate_thumbnails,
+                              prefetch_thumbnails, ready_thumbnail)
+from posts.utils import CachedCountPaginator, encode_cursor
 
 NUM_POSTS_PAG_TEST = settings.NUM_POSTS_PAG_TEST
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 QUANTITY_OF_POSTS = settings.QUANTITY_OF_POSTS
 
 
+def media_files():
+    return {
+        os.path.join(path, name)
+        for path, _, names in os.walk(TEMP_MEDIA_ROOT)
+        for name in names
+    }
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostViewsTests(TestCase):
     @classmethod
@@ -160,16 +183,213 @@ class PostViewsTests(TestCase):
         post = Post.objects.create(
             text='Пост для кэширования',
             author=self.user)
-        cache_added = self.authorized_client.get(
-            reverse('posts:main_page')).content
+        cache_added = self.client.get(reverse('posts:main_page')).content
+        with self.assertNumQueries(0):
+            cache_stored = self.client.get(
+                reverse('posts:main_page')).content
+        self.assertEqual(cache_added, cache_stored)
         post.delete()
-        cache_stored = self.authorized_client.get(
+        cache_invalidated = self.client.get(
             reverse('posts:main_page')).content
-        self.assertEqual(cache_added, cache_stored)
+        self.assertNotEqual(cache_added, cache_invalidated)
+
+    def test_post_cards_cache(self):
+        """Карточка поста кешируется и обновляется при изменениях"""
+        posts = Post.objects.select_related('author', 'group')
+        self.assertIn(self.post.text, render_cards(posts.all())[0])
+        posts.update(text='Изменено без сигналов')
+        with self.assertNumQueries(1):
+            self.assertIn(self.post.text, render_cards(posts.all())[0])
+        post = posts.get()
+        post.save()
+        self.assertIn(post.text, render_cards(posts.all())[0])
+        self.group.title = 'Новое название'
+        self.group.save()
+        self.assertIn(self.group.title, render_cards(posts.all())[0])
+        self.assertNotIn(
+            self.group.title, render_cards(posts.all(), group=True)[0])
+
+    def test_feed_fragments_follow_writes(self):
+        """Фрагменты лент группы и автора обновляются сразу после записи"""
+        urls = (
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.user.username,)),
+        )
+        for url in urls:
+            self.client.get(url)
+        post = Post.objects.create(
+            text='Свежий пост в группе',
+            author=self.user,
+            group=self.group)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), post.text)
+        group2 = Group.objects.create(title='Другая группа', slug='other')
+        post.group = group2
+        post.save()
+        self.assertNotContains(self.client.get(urls[0]), post.text)
+
+    def test_feed_fragments_follow_group_rename(self):
+        """Переименование группы обновляет профили авторов её постов"""
+        url = reverse('posts:profile', args=(self.user.username,))
+        self.client.get(url)
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Переименованная группа'
+        group.save()
+        self.assertContains(self.client.get(url), group.title)
+        group.delete()
+        self.assertNotContains(self.client.get(url), group.title)
+
+    def test_feed_fragments_follow_author_rename(self):
+        """Новое имя автора видно на страницах групп его постов"""
+        url = reverse('posts:group_list', args=(self.group.slug,))
+        self.client.get(url)
+        author = User.objects.get(pk=self.user.pk)
+        author.first_name = 'Переименованный'
+        author.save()
+        self.assertContains(self.client.get(url), author.first_name)
+
+    def test_thumbnails_are_not_generated_in_request(self):
+        """Страницы показывают заглушку, пока миниатюры не созданы"""
+        urls = (
+            reverse('posts:main_page'),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+        files = media_files()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertNotContains(response, '<img class="card-img')
+                self.assertContains(response, 'bg-light')
+        self.assertEqual(media_files(), files)
+        generate_thumbnails(self.post, post_page_paths(self.post))
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, '<img class="card-img')
+                self.assertContains(response, '<source type="image/webp"')
+                self.assertContains(response, 'width="')
+        self.assertContains(self.client.get(urls[0]), '300w')
+        self.assertContains(self.client.get(urls[0]), 'loading="lazy"')
+
+    def test_srcset_is_not_wider_than_image(self):
+        """srcset не содержит вариантов шире исходной картинки"""
+        content = BytesIO()
+        Image.new('RGB', (700, 300)).save(content, 'JPEG')
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост с широкой картинкой',
+            image=SimpleUploadedFile(
+                name='wide.jpg', content=content.getvalue(),
+                content_type='image/jpeg'
+            )
+        )
+        generate_thumbnails(post)
+        card = ready_thumbnail(post.image, 'card')
+        self.assertEqual(
+            [item.split()[1] for item in card.srcset.split(', ')],
+            ['300w', '600w']
+        )
+        detail = ready_thumbnail(post.image, 'detail')
+        self.assertEqual((detail.width, detail.height), (960, 339))
+        self.assertEqual(
+            [item.split()[1] for item in detail.srcset.split(', ')],
+            ['960w', '480w']
+        )
+
+    def test_image_placeholder(self):
+        """Заглушка картинки создаётся вместе с миниатюрами"""
+        post = Post.objects.get(pk=self.post.pk)
+        generate_thumbnails(post)
+        post.refresh_from_db()
+        placeholder = post.image_placeholder
+        self.assertTrue(placeholder.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(placeholder), 1000)
         cache.clear()
-        cache_cleared = self.authorized_client.get(
-            reverse('posts:main_page')).content
-        self.assertNotEqual(cache_added, cache_cleared)
+        response = self.client.get(reverse('posts:main_page'))
+        self.assertContains(response, f'url({placeholder})')
+
+    def test_failed_thumbnails_are_not_requeued(self):
+        """Ошибка генерации не ставит картинку в очередь на каждом
+        просмотре"""
+        post = Post.objects.get(pk=self.post.pk)
+        post.image_placeholder = ''
+        key = QUEUED_KEY.format(post.image.name)
+        with mock.patch('posts.thumbnails.make_placeholder',
+                        side_effect=OSError):
+            generate_thumbnails(post)
+        self.assertEqual(cache.get(key), post.pk)
+        self.assertFalse(cache.add(key, post.pk))
+        generate_thumbnails(post)
+        self.assertIsNone(cache.get(key))
+
+    def test_thumbnails_prefetched_for_page(self):
+        """Миниатюры страницы находятся одним запросом к KV-хранилищу"""
+        for number in range(3):
+            content = BytesIO()
+            Image.new('RGB', (2, 1), (number, 0, 0)).save(content, 'GIF')
+            Post.objects.create(
+                author=self.user,
+                text=f'Пост с картинкой {number}',
+                image=SimpleUploadedFile(
+                    name=f'small_{number}.gif',
+                    content=content.getvalue(),
+                    content_type='image/gif'
+                )
+            )
+        posts = list(Post.objects.select_related('author', 'group'))
+        generate_thumbnails(posts[0])
+        cache.clear()
+        with self.assertNumQueries(1):
+            prefetch_thumbnails(posts, 'card')
+        self.assertEqual(
+            [source['type'] for source in posts[0].thumbnails['card'].sources],
+            [content_type for _, content_type in MODERN_FORMATS]
+        )
+        self.assertEqual(
+            [post.thumbnails['card'] for post in posts[1:]],
+            [None] * (len(posts) - 1)
+        )
+        with self.assertNumQueries(0):
+            render_cards(posts)
+
+    def test_collect_media_command(self):
+        """Команда collect_media удаляет только файлы без постов"""
+        generate_thumbnails(self.post)
+        storage = self.post.image.storage
+        orphan = storage.save('posts/orphan.gif', ContentFile(b'GIF89a'))
+        stale = get_thumbnail(self.post.image, '50x50')
+        live = [self.post.image.name] + [
+            source['srcset'].split()[0]
+            for source in ready_thumbnail(self.post.image, 'card').sources
+        ]
+        out = StringIO()
+        call_command('collect_media', '--dry-run', '--min-age=0', stdout=out)
+        self.assertIn('Будет удалено: файлов', out.getvalue())
+        self.assertTrue(storage.exists(orphan))
+        self.assertTrue(stale.exists())
+        call_command('collect_media', '--min-age=0', stdout=StringIO())
+        self.assertFalse(storage.exists(orphan))
+        self.assertFalse(stale.exists())
+        self.assertTrue(storage.exists(live[0]))
+        for url in live[1:]:
+            self.assertTrue(
+                storage.exists(url[len(settings.MEDIA_URL):]), url)
+
+    def test_collect_media_in_batches(self):
+        """collect_media сверяет с базой каждую пачку отдельно"""
+        generate_thumbnails(self.post)
+        storage = self.post.image.storage
+        orphans = [
+            storage.save(f'posts/orphan_{number}.gif', ContentFile(b'GIF89a'))
+            for number in range(3)
+        ]
+        with mock.patch('posts.media_gc.BATCH_SIZE', 1):
+            call_command('collect_media', '--min-age=0', stdout=StringIO())
+        for orphan in orphans:
+            self.assertFalse(storage.exists(orphan))
+        self.assertTrue(storage.exists(self.post.image.name))
+        self.assertIsNotNone(ready_thumbnail(self.post.image, 'card'))
 
 
 class PaginatorViewsTest(TestCase):
@@ -192,6 +412,7 @@ class PaginatorViewsTest(TestCase):
         Follow.objects.create(
             user=self.user,
             author=self.user)
+        cache.clear()
 
     def test_page_contains_records(self):
         '''Проверка количества постов на странице'''
@@ -227,6 +448,359 @@ class PaginatorViewsTest(TestCase):
                             'Ошибка:неверное количество постов.'
                         )
 
+    def test_count_is_cached_until_post_write(self):
+        """Количество постов кешируется до следующей записи в Post"""
+        cache.clear()
+        posts = Post.objects.all()
+        self.assertEqual(
+            CachedCountPaginator(posts, QUANTITY_OF_POSTS).count,
+            NUM_POSTS_PAG_TEST)
+        Post.objects.bulk_create([Post(text='Без сигнала', author=self.user)])
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                CachedCountPaginator(posts, QUANTITY_OF_POSTS).count,
+                NUM_POSTS_PAG_TEST)
+        Post.objects.create(text='С сигналом', author=self.user)
+        self.assertEqual(
+            CachedCountPaginator(posts, QUANTITY_OF_POSTS).count,
+            NUM_POSTS_PAG_TEST + 2)
+        self.assertEqual(CachedCountPaginator(
+            Post.objects.filter(pk__in=[]), QUANTITY_OF_POSTS).count, 0)
+
+    @override_settings(PAGINATOR_EXACT_COUNT_LIMIT=5)
+    def test_large_count_is_estimated(self):
+        """Для длинных выборок счётчик не сбрасывается каждой записью"""
+        cache.clear()
+        posts = Post.objects.all()
+        CachedCountPaginator(posts, QUANTITY_OF_POSTS).count
+        Post.objects.create(text='Новый пост', author=self.user)
+        self.assertEqual(
+            CachedCountPaginator(posts, QUANTITY_OF_POSTS).count,
+            NUM_POSTS_PAG_TEST)
+
+    def test_page_window_has_constant_length(self):
+        """Окно номеров страниц не зависит от длины ленты"""
+        paginator = CachedCountPaginator(range(1000), QUANTITY_OF_POSTS)
+        self.assertEqual(
+            paginator.get_page_window(50),
+            [1, None, 48, 49, 50, 51, 52, None, 100])
+        self.assertEqual(
+            paginator.get_page_window(1), [1, 2, 3, None, 100])
+        self.assertEqual(
+            CachedCountPaginator(range(20), QUANTITY_OF_POSTS)
+            .get_page_window(1),
+            [1, 2])
+
+
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='random_name')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test_group')
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.user, group=cls.group)
+        cls.urls = (
+            reverse('posts:main_page'),
+            reverse('posts:group_list', args=(cls.group.slug,)),
+            reverse('posts:profile', args=(cls.user.username,)),
+            reverse('posts:post_detail', args=(cls.post.pk,)),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_anonymous_pages_are_cached(self):
+        """Анонимные страницы отдаются из кеша без запросов к базе"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.client.get(url)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertContains(response, self.post.text)
+
+    def test_logged_in_pages_are_not_cached(self):
+        """Вошедшие пользователи получают страницу, отрисованную заново"""
+        url = reverse('posts:post_detail', args=(self.post.pk,))
+        self.authorized_client.get(url)
+        response = self.authorized_client.get(url)
+        self.assertIsNotNone(response.context)
+
+    def test_writes_purge_affected_pages(self):
+        """Новый пост и комментарий сбрасывают затронутые страницы"""
+        for url in self.urls:
+            self.client.get(url)
+        post = Post.objects.create(
+            text='Свежий пост', author=self.user, group=self.group)
+        for url in self.urls[:3]:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), post.text)
+        with self.assertNumQueries(0):
+            self.client.get(self.urls[3])
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Новый комментарий')
+        self.assertContains(self.client.get(self.urls[3]), 'Новый комментарий')
+
+    def test_non_ascii_paths_are_purged(self):
+        """Запись сбрасывает профиль автора с кириллическим именем"""
+        author = User.objects.create_user(username='Лев')
+        url = reverse('posts:profile', args=(author.username,))
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        post = Post.objects.create(text='Пост Льва', author=author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, post.text)
+
+    def test_conditional_get(self):
+        """Неизменившиеся страницы отвечают 304 без запросов к базе"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                etag = response['ETag']
+                self.assertFalse(response.has_header('Last-Modified'))
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Новый комментарий')
+        response = self.client.get(self.urls[3], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_no_validators_for_logged_in_users(self):
+        """Вошедший пользователь не получает 304: в странице CSRF-токен"""
+        url = self.urls[3]
+        etag = self.client.get(url)['ETag']
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(KEYSET_PAGINATION=True)
+class KeysetPaginatorViewsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='random_name')
+        self.group = Group.objects.create(title='Тестовая группа',
+                                          slug='test_group')
+        Post.objects.bulk_create(
+            Post(text=f'Тестовый пост {post}',
+                 group=self.group,
+                 author=self.user)
+            for post in range(NUM_POSTS_PAG_TEST)
+        )
+        cache.clear()
+
+    def test_pages_follow_cursor(self):
+        """Курсорная пагинация отдаёт все посты без повторов"""
+        urls = (
+            reverse('posts:main_page'),
+            reverse('posts:profile', args=(self.user.username,)),
+            reverse('posts:group_list', args=(self.group.slug,)),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                first = self.client.get(url).context['page_obj']
+                self.assertEqual(len(first), QUANTITY_OF_POSTS)
+                self.assertFalse(first.has_previous())
+                second = self.client.get(
+                    url, {'after': first.next_cursor}).context['page_obj']
+                self.assertEqual(
+                    len(second), NUM_POSTS_PAG_TEST - QUANTITY_OF_POSTS)
+                self.assertFalse(second.has_next())
+                self.assertEqual(
+                    set(first) | set(second), set(Post.objects.all()))
+                back = self.client.get(
+                    url, {'before': second.previous_cursor}
+                ).context['page_obj']
+                self.assertEqual(list(back), list(first))
+
+    def test_new_posts_do_not_shift_pages(self):
+        """Новые посты не сдвигают уже открытую страницу"""
+        url = reverse('posts:main_page')
+        first = self.client.get(url).context['page_obj']
+        expected = list(
+            self.client.get(
+                url, {'after': first.next_cursor}).context['page_obj']
+        )
+        Post.objects.create(text='Свежий пост', author=self.user)
+        second = self.client.get(
+            url, {'after': first.next_cursor}).context['page_obj']
+        self.assertEqual(list(second), expected)
+
+    def test_broken_cursor_returns_first_page(self):
+        """Испорченный токен ведёт на первую страницу"""
+        response = self.client.get(
+            reverse('posts:main_page'), {'after': '%%%'})
+        self.assertEqual(len(response.context['page_obj']), QUANTITY_OF_POSTS)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+
+class SearchViewsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='random_name')
+        Post.objects.bulk_create(
+            Post(text=f'Поиск по записям {post}', author=self.user)
+            for post in range(NUM_POSTS_PAG_TEST)
+        )
+        self.post = Post.objects.create(
+            text='Котики <b>и</b> собаки', author=self.user)
+
+    def search(self, query, **params):
+        return self.client.get(
+            reverse('posts:search'), {'q': query, **params}
+        ).context['page_obj']
+
+    def test_search_highlights_snippet(self):
+        """Поиск находит пост по префиксу слова и экранирует сниппет"""
+        response = self.client.get(reverse('posts:search'), {'q': 'кот'})
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+        self.assertContains(
+            response, '<mark>Котики</mark> &lt;b&gt;и&lt;/b&gt; собаки')
+        self.assertEqual(len(self.search('"кот" OR NEAR(')), 0)
+        self.assertEqual(len(self.search('')), 0)
+
+    def test_index_follows_changes(self):
+        """Индекс обновляется при изменении и удалении постов"""
+        Post.objects.filter(pk=self.post.pk).update(text='Только собаки')
+        self.assertEqual(len(self.search('котики')), 0)
+        self.assertEqual(list(self.search('собаки')), [self.post])
+        self.post.delete()
+        self.assertEqual(len(self.search('собаки')), 0)
+
+    def test_pages_follow_cursor(self):
+        """Результаты листаются по курсору без повторов"""
+        first = self.search('записям')
+        self.assertEqual(len(first), QUANTITY_OF_POSTS)
+        second = self.search('записям', after=first.next_cursor)
+        self.assertEqual(
+            len(second), NUM_POSTS_PAG_TEST - QUANTITY_OF_POSTS)
+        self.assertFalse(second.has_next())
+        self.assertEqual(
+            set(first) | set(second),
+            set(Post.objects.exclude(pk=self.post.pk))
+        )
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идёт по индексу FTS5"""
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'котики'})
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.post])
+        self.assertTrue(any(
+            'MATCH' in query['sql'] for query in queries.captured_queries))
+        self.assertFalse(any(
+            'LIKE' in query['sql'] for query in queries.captured_queries))
+
+
+class AutocompleteViewsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='leo', first_name='Лев', last_name='Толстой')
+        User.objects.create_user(username='fedor')
+        self.group = Group.objects.create(
+            title='Ёжики в тумане', slug='hedgehogs')
+
+    def suggest(self, query):
+        response = self.client.get(reverse('posts:autocomplete'), {'q': query})
+        return response.json()['results']
+
+    def test_prefix_suggestions(self):
+        """Подсказки ищутся по началу имени, логина и названия группы"""
+        user = {
+            'type': 'user',
+            'label': 'Лев Толстой (@leo)',
+            'url': reverse('posts:profile', args=('leo',)),
+        }
+        group = {
+            'type': 'group',
+            'label': 'Ёжики в тумане',
+            'url': reverse('posts:group_list', args=('hedgehogs',)),
+        }
+        for query, expected in (
+            ('LE', [user]),
+            ('толс', [user]),
+            ('ежики в', [group]),
+            ('hedge', [group]),
+            ('', []),
+            ('x', []),
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(self.suggest(query), expected)
+
+    def test_index_is_refreshed_on_write(self):
+        """Индекс живёт в памяти и обновляется при записи"""
+        self.suggest('f')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.suggest('f')), 1)
+        User.objects.create_user(username='fyodor')
+        self.assertEqual(len(self.suggest('f')), 2)
+        self.group.delete()
+        self.assertEqual(self.suggest('ёж'), [])
+
+    def test_admin_search_uses_index(self):
+        """Поиск групп и подписок в админке идёт по префиксному индексу"""
+        Follow.objects.create(user=self.user, author=self.user)
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        for url, query, expected in (
+            (reverse('admin:posts_group_changelist'), 'ёж', 1),
+            (reverse('admin:posts_follow_changelist'), 'лев', 1),
+            (reverse('admin:auth_user_changelist'), 'fed', 1),
+            (reverse('admin:posts_group_changelist'), 'тума', 0),
+        ):
+            with self.subTest(url=url, query=query):
+                response = self.client.get(url, {'q': query})
+                self.assertEqual(
+                    len(response.context['cl'].result_list), expected)
+
+    def test_admin_finds_inactive_users_and_emails(self):
+        """Админка находит неактивных пользователей, почту и часть
+        фамилии, а подсказки сайта неактивных не показывают"""
+        User.objects.create_user(
+            'ghost', 'ghost@example.com', is_active=False)
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        url = reverse('admin:auth_user_changelist')
+        for query, expected in (
+            ('ghost', ['ghost']),
+            ('ghost@example.com', ['ghost']),
+            ('олсто', ['leo']),
+        ):
+            with self.subTest(query=query):
+                response = self.client.get(url, {'q': query})
+                self.assertEqual(
+                    [user.username
+                     for user in response.context['cl'].result_list],
+                    expected)
+        self.assertEqual(self.suggest('gh'), [])
+
+    def test_admin_search_warns_about_limit(self):
+        """Поиск в админке сообщает, что совпадений больше лимита"""
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        User.objects.create_user(username='fedya')
+        url = reverse('admin:auth_user_changelist')
+        with mock.patch('posts.admin.ADMIN_SEARCH_LIMIT', 1):
+            response = self.client.get(url, {'q': 'fed'})
+            self.assertContains(response, 'Уточните запрос')
+            self.assertEqual(len(response.context['cl'].result_list), 1)
+            response = self.client.get(url, {'q': 'fedo'})
+            self.assertNotContains(response, 'Уточните запрос')
+
 
 class FollowViewsTest(TestCase):
     @classmethod
@@ -297,6 +871,62 @@ class FollowViewsTest(TestCase):
             reverse('posts:follow_index'))
         self.assertNotIn(post, response.context['page_obj'])
 
+    def test_unfollow_and_delete_clear_timeline(self):
+        """Отписка и удаление поста убирают его из ленты подписок"""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='Ещё пост', author=self.author)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.user).count(), 2)
+        post.delete()
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.user).count(), 1)
+        self.authorised_client.post(
+            reverse('posts:profile_unfollow', args=(self.author,)))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    def test_rebuild_timeline_command(self):
+        """Команда rebuild_timeline восстанавливает ленты по подпискам"""
+        Follow.objects.create(user=self.user, author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timeline', stdout=StringIO())
+        response = self.authorised_client.get(reverse('posts:follow_index'))
+        self.assertIn(self.post, response.context['page_obj'])
+
+    @override_settings(FOLLOW_FEED_SOURCE='cache', AUTHOR_RECENT_POSTS=12)
+    def test_cached_follow_feed_matches_timeline(self):
+        """Слияние кешированных списков авторов даёт ту же ленту"""
+        other_author = User.objects.create_user(username='other_author')
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.user, author=other_author)
+        for number in range(NUM_POSTS_PAG_TEST):
+            Post.objects.create(
+                text=f'Пост {number}',
+                author=(self.author, other_author)[number % 2],
+            )
+        expected = list(
+            Post.objects.filter(timeline_entries__user=self.user)
+            .order_by('-pub_date', 'pk')
+        )
+        feed = []
+        for page in (1, 2):
+            response = self.authorised_client.get(
+                reverse('posts:follow_index'), {'page': page})
+            feed.extend(response.context['page_obj'])
+        self.assertEqual(feed, expected)
+        expected[0].delete()
+        response = self.authorised_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']),
+            expected[1:QUANTITY_OF_POSTS + 1],
+        )
+        posts = [
+            Post.objects.create(text=f'Новый пост {number}', author=author)
+            for number, author in enumerate((self.author, other_author))
+        ]
+        response = self.authorised_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj'])[:2], posts[::-1])
+
     def test_double_follow(self):
         """Проверка невозможности подписки на пользователя два раза"""
         Follow.objects.all().delete()
@@ -324,3 +954,115 @@ class FollowViewsTest(TestCase):
             )
         )
         self.assertEqual(Follow.objects.count(), 0)
+
+
+class QueryPlanTest(TestCase):
+    """Запросы лент читаются по индексам, без полного обхода таблиц
+    и без сортировки во временном B-дереве."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='random_name')
+        cls.author = User.objects.create_user(username='random_author')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test_group')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for number in range(NUM_POSTS_PAG_TEST):
+            cls.post = Post.objects.create(
+                text=f'Тестовый пост {number}',
+                author=cls.author,
+                group=cls.group,
+            )
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text='Комментарий')
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def get_plans(self, url, data):
+        with CaptureQueriesContext(connection) as context:
+            self.authorized_client.get(url, data)
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or '"posts_' not in sql:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                yield sql, [row[-1] for row in cursor.fetchall()]
+
+    def test_feed_queries_use_indexes(self):
+        """Ленты и страница поста не сортируют и не сканируют таблицы"""
+        cursor = {'after': encode_cursor(self.post)}
+        urls = (
+            (reverse('posts:main_page'), {}),
+            (reverse('posts:main_page'), cursor),
+            (reverse('posts:group_list', args=(self.group.slug,)), {}),
+            (reverse('posts:group_list', args=(self.group.slug,)), cursor),
+            (reverse('posts:profile', args=(self.author.username,)), {}),
+            (reverse('posts:profile', args=(self.author.username,)), cursor),
+            (reverse('posts:follow_index'), {}),
+            (reverse('posts:follow_index'), cursor),
+            (reverse('posts:post_detail', args=(self.post.pk,)), {}),
+        )
+        for url, data in urls:
+            for sql, plan in self.get_plans(url, data):
+                with self.subTest(url=url, data=data, sql=sql):
+                    for step in plan:
+                        self.assertNotIn('TEMP B-TREE', step)
+                        self.assertFalse(
+                            step.startswith('SCAN')
+                            and 'USING' not in step
+                            and 'subquery' not in step,
+                            f'Полный обход таблицы: {step}'
+                        )
+
+
+class AdminChangelistTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.urls = (
+            reverse('admin:posts_post_changelist'),
+            reverse('admin:posts_comment_changelist'),
+            reverse('admin:posts_follow_changelist'),
+        )
+
+    def add_rows(self, number):
+        author = User.objects.create_user(username=f'author_{number}')
+        group = Group.objects.create(
+            title=f'Группа {number}', slug=f'group_{number}')
+        post = Post.objects.create(text='Пост', author=author, group=group)
+        Comment.objects.create(post=post, author=author, text='Комментарий')
+        Follow.objects.create(user=self.user, author=author)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [query['sql'] for query in context.captured_queries]
+
+    def test_changelist_queries_do_not_grow(self):
+        """Число запросов списка не зависит от числа строк"""
+        self.add_rows(0)
+        expected = {url: len(self.count_queries(url)) for url in self.urls}
+        for number in range(1, 4):
+            self.add_rows(number)
+        cache.clear()
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(len(self.count_queries(url)), expected[url])
+
+    def test_changelist_count_is_cached(self):
+        """Повторный показ списка не считает строки заново"""
+        self.add_rows(0)
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.count_queries(url)
+                queries = self.count_queries(url)
+                self.assertFalse(any('COUNT(' in sql for sql in queries))
@@ -0,0 +1,318 @@
+import logging
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import EXTENSIONS
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import \
+    KVStore as CachedDBKVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from . import cards
+from .generations import bump_generation, post_scopes
+from .images import make_placeholder
+from .models import Post
+from .page_cache import post_page_paths, purge_pages
+
+logger = logging.getLogger(__name__)
+
+# Все миниатюры, которые выводят шаблоны. Первая геометрия набора
+# основная (src, width и height), остальные попадают только в srcset
+# и только если не шире исходной картинки.
+THUMBNAILS = {
+    'card': ('300x100', '600x200', '1200x400'),
+    'detail': ('960x339', '480x170', '1920x678'),
+}
+# Ширина картинки в вёрстке (атрибут sizes): по ней браузер выбирает
+# файл из srcset с учётом плотности пикселей экрана.
+THUMBNAIL_SIZES = {
+    'card': ('(min-width: 1200px) 1110px, (min-width: 992px) 930px, '
+             '(min-width: 768px) 690px, (min-width: 576px) 510px, 100vw'),
+    'detail': '(min-width: 1200px) 825px, (min-width: 768px) 75vw, 100vw',
+}
+# Увеличивается только основной вариант, и только когда картинка
+# меньше его: вёрстке нужен кадр заданного размера. Варианты srcset
+# шире картинки не создаются вовсе.
+THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+
+
+def modern_formats():
+    """Современные форматы в порядке предпочтения: браузер берёт первый
+    поддерживаемый <source>. Формат включается, если его умеют
+    записывать и Pillow, и sorl."""
+    Image.init()
+    return tuple(
+        (image_format, content_type)
+        for image_format, content_type in (
+            ('AVIF', 'image/avif'),
+            ('WEBP', 'image/webp'),
+        )
+        if image_format in EXTENSIONS and image_format in Image.SAVE
+    )
+
+
+MODERN_FORMATS = modern_formats()
+THUMBNAIL_FORMATS = (None, *(fmt for fmt, _ in MODERN_FORMATS))
+
+QUEUED_KEY = 'posts:thumbnails:queued:{}'
+QUEUED_TIMEOUT = 60 * 5
+# После ошибки картинка не встаёт в очередь столько секунд: битый файл
+# не декодируется заново на каждом просмотре.
+FAILED_TIMEOUT = 60 * 60
+
+_deferred = threading.local()
+
+
+def start_deferred():
+    _deferred.jobs = []
+
+
+def run_deferred():
+    """Выполняет задачи запроса после того, как ответ отправлен."""
+    jobs, _deferred.jobs = getattr(_deferred, 'jobs', None) or [], None
+    for job in jobs:
+        job()
+
+
+def defer(job):
+    """Откладывает задачу до конца текущего запроса; вне запроса
+    (команды, shell) выполняет сразу."""
+    jobs = getattr(_deferred, 'jobs', None)
+    if jobs is None:
+        job()
+    else:
+        jobs.append(job)
+
+
+class Thumbnail:
+    """Готовый набор миниатюр: основная картинка, srcset в основном
+    формате и источники <picture> в современных форматах."""
+
+    def __init__(self, size, files):
+        geometries = list(dict.fromkeys(
+            geometry for geometry, _ in files
+        ))
+        self.image = files[geometries[0], None]
+        self.sizes = THUMBNAIL_SIZES[size]
+        self.srcset = self.build_srcset(files, geometries, None)
+        self.sources = []
+        for image_format, content_type in MODERN_FORMATS:
+            srcset = self.build_srcset(files, geometries, image_format)
+            if srcset:
+                self.sources.append({'type': content_type, 'srcset': srcset})
+
+    @staticmethod
+    def build_srcset(files, geometries, image_format):
+        return ', '.join(
+            f'{variant.url} {variant.width}w'
+            for variant in (
+                files[geometry, image_format] for geometry in geometries
+            )
+            if variant is not None
+        )
+
+    @property
+    def url(self):
+        return self.image.url
+
+    @property
+    def width(self):
+        return self.image.width
+
+    @property
+    def height(self):
+        return self.image.height
+
+
+def thumbnail_options(source, image_format=None):
+    """Параметры миниатюры с умолчаниями sorl, как в
+    ThumbnailBackend.get_thumbnail: от них зависит имя файла."""
+    backend = default.backend
+    options = dict(THUMBNAIL_OPTIONS)
+    if image_format:
+        options['format'] = image_format
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def thumbnail_file(image, geometry, image_format=None):
+    """Файл миниатюры картинки: имя вычисляется без обращения к диску."""
+    source = ImageFile(image)
+    name = default.backend._get_thumbnail_filename(
+        source, geometry, thumbnail_options(source, image_format)
+    )
+    return ImageFile(name, default.storage)
+
+
+def geometry_width(geometry):
+    return int(geometry.split('x')[0])
+
+
+def thumbnail_variants(size, width=None):
+    """Геометрии и форматы набора для картинки шириной width; основной
+    вариант первый. Пока ширина неизвестна, набор состоит из основного
+    варианта."""
+    base, *extra = THUMBNAILS[size]
+    geometries = [base] + [
+        geometry for geometry in extra
+        if width and geometry_width(geometry) <= width
+    ]
+    return [
+        (geometry, image_format)
+        for geometry in geometries
+        for image_format in THUMBNAIL_FORMATS
+    ]
+
+
+def image_variants(image, size):
+    return thumbnail_variants(size, image.instance.image_width)
+
+
+def thumbnail_keys(image, size):
+    """Ключи KV-хранилища всех вариантов набора миниатюр."""
+    return [
+        add_prefix(thumbnail_file(image, geometry, image_format).key)
+        for geometry, image_format in image_variants(image, size)
+    ]
+
+
+def build_thumbnail(image, size, values):
+    """Набор миниатюр из значений хранилища по ключам thumbnail_keys или
+    None, пока не готов основной вариант."""
+    if not values[0]:
+        return None
+    return Thumbnail(size, {
+        variant: deserialize_image_file(value) if value else None
+        for variant, value in zip(image_variants(image, size), values)
+    })
+
+
+def get_many_raw(keys):
+    """Значения KV-хранилища sorl по списку ключей.
+
+    Для хранилища по умолчанию (кеш поверх таблицы) это одно чтение кеша
+    и один запрос к таблице за промахами, а не запрос на каждый ключ.
+    """
+    kvstore = default.kvstore
+    if not isinstance(kvstore, CachedDBKVStore):
+        return {key: kvstore._get_raw(key) for key in keys}
+    values = kvstore.cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        found = dict(
+            KVStoreModel.objects.filter(
+                key__in=missing
+            ).values_list('key', 'value')
+        )
+        # Как и sorl, запоминаем отсутствие ключа, чтобы не ходить в базу.
+        found.update(
+            (key, EMPTY_VALUE) for key in missing if key not in found
+        )
+        kvstore.cache.set_many(found, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(found)
+    return {
+        key: None if value == EMPTY_VALUE else value
+        for key, value in values.items()
+    }
+
+
+def prefetch_thumbnails(posts, size):
+    """Находит готовые миниатюры всех постов страницы одним обращением
+    к KV-хранилищу и сохраняет их в post.thumbnails.
+
+    Отсутствующие миниатюры ставятся в очередь, шаблон выводит для них
+    заглушку.
+    """
+    keys = {post: thumbnail_keys(post.image, size)
+            for post in posts if post.image}
+    values = get_many_raw([key for post in keys for key in keys[post]])
+    for post, post_keys in keys.items():
+        thumbnail = build_thumbnail(
+            post.image, size, [values.get(key) for key in post_keys]
+        )
+        post.thumbnails = {**getattr(post, 'thumbnails', {}), size: thumbnail}
+        if thumbnail is None or not post.image_placeholder:
+            schedule_post_thumbnails(post)
+
+
+def ready_thumbnail(image, size):
+    """Готовая миниатюра из хранилища sorl или None.
+
+    В отличие от тега thumbnail ничего не создаёт: отсутствующая
+    миниатюра ставится в очередь и создаётся после отправки ответа.
+    Если страница заранее вызвала prefetch_thumbnails, хранилище
+    не читается.
+    """
+    if not image:
+        return None
+    post = image.instance
+    thumbnails = getattr(post, 'thumbnails', {})
+    if size in thumbnails:
+        return thumbnails[size]
+    keys = thumbnail_keys(image, size)
+    values = get_many_raw(keys)
+    thumbnail = build_thumbnail(
+        image, size, [values.get(key) for key in keys]
+    )
+    if thumbnail is None or not post.image_placeholder:
+        schedule_post_thumbnails(post)
+    return thumbnail
+
+
+def schedule_post_thumbnails(post):
+    schedule_thumbnails(post, [post.group.slug] if post.group else [])
+
+
+def schedule_thumbnails(post, group_slugs=()):
+    """Ставит генерацию миниатюр поста в очередь после фиксации
+    транзакции; повторные вызовы для той же картинки не дублируются."""
+    if not cache.add(QUEUED_KEY.format(post.image.name), post.pk,
+                     QUEUED_TIMEOUT):
+        return
+    paths = post_page_paths(post, group_slugs)
+    transaction.on_commit(
+        lambda: defer(lambda: generate_thumbnails(post, paths))
+    )
+
+
+def generate_thumbnails(post, paths=()):
+    """Создаёт все миниатюры и заглушку картинки поста и сбрасывает
+    карточки и страницы, отрисованные без них."""
+    try:
+        for size in THUMBNAILS:
+            for geometry, image_format in image_variants(post.image, size):
+                options = dict(THUMBNAIL_OPTIONS)
+                if image_format:
+                    options['format'] = image_format
+                get_thumbnail(post.image, geometry, **options)
+        if not post.image_placeholder:
+            with post.image.open('rb') as file:
+                post.image_placeholder = make_placeholder(file)
+            # Картинку могли заменить, пока задача ждала в очереди.
+            Post.objects.filter(pk=post.pk, image=post.image.name).update(
+                image_placeholder=post.image_placeholder,
+                updated=timezone.now(),
+            )
+    except Exception:
+        logger.exception('Не удалось создать миниатюры поста %s', post.pk)
+        cache.set(QUEUED_KEY.format(post.image.name), post.pk, FAILED_TIMEOUT)
+        return
+    cache.delete(QUEUED_KEY.format(post.image.name))
+    cards.drop_cards(post)
+    bump_generation(*post_scopes(post))
+    purge_pages(*paths)
@@ -1,10 +1,202 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import hashlib
+
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
 from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from core.routers import replica_cache_timeout
+
+from .generations import get_generations
 
 QUANTITY_OF_POSTS = settings.QUANTITY_OF_POSTS
+KEYSET_FIELDS = ('pub_date', 'pk')
+
+
+def encode_cursor(post):
+    """Непрозрачный токен позиции поста в ленте."""
+    raw = f'{post.pub_date.isoformat()}|{post.pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает пару (pub_date, pk) или None для испорченного токена."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        pub_date, pk = raw.decode().split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, pk
+
+
+class KeysetPage(Page):
+    """Страница ленты без номера и без общего количества постов."""
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        super().__init__(object_list, None, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<Keyset page of {len(self.object_list)} posts>'
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return encode_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return encode_cursor(self.object_list[0])
+        return None
+
+
+class KeysetPaginator(Paginator):
+    """Пагинация по ключу (pub_date, id): без COUNT(*) и без OFFSET.
+
+    Страница выбирается относительно поста из токена, поэтому новые
+    публикации не сдвигают уже открытые страницы. При равных датах посты
+    идут по возрастанию id: в индексах по -pub_date rowid хранится по
+    возрастанию, и такой порядок читается из индекса без сортировки.
+    """
+    keyset = True
+
+    def __init__(self, object_list, per_page, key_fields=KEYSET_FIELDS,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.key_fields = key_fields
+
+    def get_keyset_page(self, after=None, before=None):
+        # Ленты, собранные не из QuerySet, отдают запасной запрос.
+        posts = getattr(self.object_list, 'queryset', self.object_list)
+        date_field, pk_field = getattr(
+            self.object_list, 'key_fields', self.key_fields
+        )
+        cursor = decode_cursor(before) if before else None
+        if cursor is not None:
+            pub_date, pk = cursor
+            rows = list(
+                posts.filter(
+                    Q(**{f'{date_field}__gt': pub_date})
+                    | Q(**{date_field: pub_date, f'{pk_field}__lt': pk})
+                ).order_by(date_field, f'-{pk_field}')[:self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(rows, self, True, has_previous)
+        cursor = decode_cursor(after) if after else None
+        if cursor is not None:
+            pub_date, pk = cursor
+            posts = posts.filter(
+                Q(**{f'{date_field}__lt': pub_date})
+                | Q(**{date_field: pub_date, f'{pk_field}__gt': pk})
+            )
+        rows = list(
+            posts.order_by(f'-{date_field}', pk_field)[:self.per_page + 1]
+        )
+        has_next = len(rows) > self.per_page
+        return KeysetPage(
+            rows[:self.per_page], self, has_next, cursor is not None
+        )
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, который не считает COUNT(*) на каждый запрос.
+
+    Количество небольших выборок кешируется до следующей записи в Post
+    или Follow.
+    Для выборок длиннее PAGINATOR_EXACT_COUNT_LIMIT используется оценка:
+    последнее точное значение, которое живёт PAGINATOR_ESTIMATE_TIMEOUT
+    и не сбрасывается при каждой новой записи.
+    """
+    # Области, запись в которые меняет количество.
+    count_scopes = ('posts', 'follows')
+
+    def count_cache_key(self, posts):
+        if not isinstance(posts, QuerySet):
+            return None
+        try:
+            sql = str(posts.query)
+        except EmptyResultSet:
+            # Заведомо пустая выборка: считать нечего.
+            return None
+        return 'posts:count:' + hashlib.md5(sql.encode()).hexdigest()
+
+    @cached_property
+    def count(self):
+        # Ленты, собранные не из QuerySet, отдают запасной запрос.
+        posts = getattr(self.object_list, 'queryset', self.object_list)
+        base_key = self.count_cache_key(posts)
+        if base_key is None:
+            return super().count
+        estimate_key = f'{base_key}:estimate'
+        estimate = cache.get(estimate_key)
+        if estimate is not None:
+            return estimate
+        generations = get_generations(*self.count_scopes)
+        key = f'{base_key}:{":".join(map(str, generations))}'
+        count = cache.get(key)
+        if count is not None:
+            return count
+        limit = settings.PAGINATOR_EXACT_COUNT_LIMIT
+        count = posts.order_by()[:limit + 1].count()
+        if count > limit:
+            count = super().count
+            cache.set(estimate_key, count, replica_cache_timeout(
+                settings.PAGINATOR_ESTIMATE_TIMEOUT
+            ))
+        else:
+            cache.set(key, count, replica_cache_timeout(
+                settings.PAGINATOR_COUNT_TIMEOUT
+            ))
+        return count
+
+    def get_page_window(self, number, on_each_side=2, on_ends=1):
+        """Окно номеров страниц постоянной длины; None обозначает пропуск."""
+        window = []
+        if number > on_each_side + on_ends + 2:
+            window.extend(range(1, on_ends + 1))
+            window.append(None)
+            start = number - on_each_side
+        else:
+            start = 1
+        if number < self.num_pages - on_each_side - on_ends - 1:
+            window.extend(range(start, number + on_each_side + 1))
+            window.append(None)
+            window.extend(
+                range(self.num_pages - on_ends + 1, self.num_pages + 1)
+            )
+        else:
+            window.extend(range(start, self.num_pages + 1))
+        return window
 
 
-def get_page_context(request, posts):
-    paginator = Paginator(posts, QUANTITY_OF_POSTS)
+def get_page_context(request, posts, keyset=None,
+                     key_fields=KEYSET_FIELDS):
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if keyset is None:
+        keyset = settings.KEYSET_PAGINATION
+    if keyset or after or before:
+        paginator = KeysetPaginator(posts, QUANTITY_OF_POSTS, key_fields)
+        return paginator.get_keyset_page(after, before)
+    paginator = CachedCountPaginator(posts, QUANTITY_OF_POSTS)
     page_number = request.GET.get('page')
     return paginator.get_page(page_number)
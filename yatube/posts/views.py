@@ -1,20 +1,39 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
+from core.routers import replica_cache_timeout, replica_reads
+
+from .autocomplete import suggestions
 from .forms import CommentForm, PostForm
+from .generations import author_scope, get_generation, group_scope
 from .models import Comment, Follow, Group, Post, User
+from .page_cache import cache_anonymous_page, conditional_page
+from .search import search_posts
+from .timeline import TIMELINE_KEY_FIELDS, follow_feed
 from .utils import get_page_context
 
+FEED_CACHE_TIMEOUT = settings.FEED_CACHE_TIMEOUT
+
 
+@replica_reads
+@conditional_page
+@cache_anonymous_page
 def index(request):
     posts = Post.objects.select_related('author', 'group').all()
     page_obj = get_page_context(request, posts)
     context = {
         'page_obj': page_obj,
+        'cache_timeout': replica_cache_timeout(FEED_CACHE_TIMEOUT),
+        'generation': get_generation('posts'),
     }
     return render(request, 'posts/index.html', context)
 
 
+@replica_reads
+@conditional_page
+@cache_anonymous_page
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     posts = group.posts.select_related('author').all()
@@ -22,12 +41,19 @@ def group_posts(request, slug):
     context = {
         'group': group,
         'page_obj': page_obj,
+        'cache_timeout': replica_cache_timeout(FEED_CACHE_TIMEOUT),
+        'generation': get_generation(group_scope(group.pk)),
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@replica_reads
+@conditional_page
+@cache_anonymous_page
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(
+        User.objects.select_related('profile'), username=username
+    )
     posts = author.posts.select_related('group')
     page_obj = get_page_context(request, posts)
     following = (
@@ -38,13 +64,18 @@ def profile(request, username):
         'author': author,
         'page_obj': page_obj,
         'following': following,
+        'cache_timeout': replica_cache_timeout(FEED_CACHE_TIMEOUT),
+        'generation': get_generation(author_scope(author.pk)),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@replica_reads
+@conditional_page
+@cache_anonymous_page
 def post_detail(request, post_id):
     post = get_object_or_404(
-        Post.objects.select_related('author')
+        Post.objects.select_related('author__profile', 'group')
         .prefetch_related('comments__author'),
         pk=post_id
     )
@@ -58,6 +89,22 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'page_obj': search_posts(query, request.GET.get('after')),
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def autocomplete(request):
+    return JsonResponse(
+        {'results': suggestions(request.GET.get('q', ''))},
+        json_dumps_params={'ensure_ascii': False},
+    )
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -144,12 +191,11 @@ def edit_comment(request, post_id, id):
 
 
 @login_required
+@replica_reads
 def follow_index(request):
-    posts = (
-        Post.objects.select_related('author')
-        .filter(author__following__user=request.user)
+    page_obj = get_page_context(
+        request, follow_feed(request.user), key_fields=TIMELINE_KEY_FIELDS
     )
-    page_obj = get_page_context(request, posts)
     context = {'page_obj': page_obj}
     return render(request, 'posts/follow.html', context)
 
@@ -0,0 +1,31 @@
+// Подсказки авторов и групп в поиске шапки сайта.
+(function () {
+  var input = document.getElementById('header-search');
+  var list = document.getElementById('header-search-list');
+  if (!input || !list) {
+    return;
+  }
+  var urls = {};
+  var timer = null;
+  input.addEventListener('input', function () {
+    if (urls[input.value]) {
+      window.location = urls[input.value];
+      return;
+    }
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      fetch(input.dataset.url + '?q=' + encodeURIComponent(input.value))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          urls = {};
+          list.innerHTML = '';
+          data.results.forEach(function (result) {
+            var option = document.createElement('option');
+            option.value = result.label;
+            urls[result.label] = result.url;
+            list.appendChild(option);
+          });
+        });
+    }, 150);
+  });
+})();
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -16,9 +17,19 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Кеш общий для всех процессов сервера: поколения из posts.generations
+# сбрасывают фрагменты, страницы, ETag, счётчики и карточки во всех
+# воркерах сразу. С кешем в памяти процесса запись в одном воркере
+# не видна другим, и они отдавали бы старые данные до истечения
+# FEED_CACHE_TIMEOUT. При вытеснении поколение создаётся заново
+# и только сбрасывает зависимые записи.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'yatube_cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
@@ -52,6 +63,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.routers.ReadYourWritesMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -63,6 +75,24 @@ TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Отдача медиафайлов приложением: None — сами файлы через FileResponse
+# (sendfile через wsgi.file_wrapper сервера), 'x-accel-redirect' для nginx
+# (internal-location с префиксом MEDIA_ACCEL_REDIRECT_PREFIX) или
+# 'x-sendfile' для Apache
+MEDIA_SENDFILE = None
+
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Картинки постов и миниатюры названы по содержимому и кешируются навсегда
+MEDIA_IMMUTABLE_PREFIXES = ('posts/', 'cache/')
+
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24
+
+# Картинки, загруженные (или загруженные повторно) позже стольких секунд
+# назад, не удаляются: пост, который на них ссылается, мог ещё
+# не сохраниться
+MEDIA_GC_MIN_AGE = 60 * 60
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -86,7 +116,37 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    # Копия основной базы для чтения; её обновляет команда
+    # sync_replica (например, sync_replica --interval 5).
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+
+# Базы, с которых читают ленты и страница поста; пустой список —
+# всё читается из основной базы. Для реплики-копии: ['replica']
+DATABASE_REPLICAS = []
+
+# Сколько секунд после записи пользователь читает основную базу;
+# должно быть больше отставания реплики
+REPLICA_PIN_SECONDS = 15
+
+# Настройки SQLite для каждого нового соединения: WAL, чтобы чтение
+# не ждало записи, fsync только на контрольных точках (synchronous=NORMAL),
+# отображение файла в память, кеш страниц 64 МБ и ожидание блокировки
+# вместо ошибки «database is locked»; пустой словарь отключает настройку.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -126,6 +186,45 @@ STATIC_URL = '/static/'
 
 QUANTITY_OF_POSTS = 10
 
+# Курсорная пагинация лент вместо ?page=N (без COUNT и OFFSET)
+KEYSET_PAGINATION = False
+
+# Источник ленты подписок: 'timeline' (таблица) или 'cache' (слияние
+# кешированных списков свежих постов авторов)
+FOLLOW_FEED_SOURCE = 'timeline'
+
+AUTHOR_RECENT_POSTS = 100
+
+# Срок жизни списка свежих постов автора: ограничивает устаревание,
+# если список перечитали одновременно с записью
+AUTHOR_RECENT_POSTS_TIMEOUT = 60 * 10
+
+FOLLOW_MERGE_MAX_AUTHORS = 200
+
+# Время жизни кеша фрагментов лент: записи сбрасывают его сразу
+# через поколения в posts.generations
+FEED_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Кеш отрисованных карточек постов, общий для всех лент
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Кеш готовых страниц для анонимных посетителей; 0 отключает кеш.
+# Страницы сбрасываются при изменении постов и комментариев.
+ANONYMOUS_PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Загружаемые картинки: предельное число пикселей (защита от
+# картинок-бомб) и длинная сторона, до которой уменьшается оригинал
+POST_IMAGE_MAX_PIXELS = 50 * 10 ** 6
+
+POST_IMAGE_MAX_SIZE = 2048
+
+# Кеширование количества постов в пагинаторе
+PAGINATOR_COUNT_TIMEOUT = 60 * 60
+
+PAGINATOR_EXACT_COUNT_LIMIT = 10000
+
+PAGINATOR_ESTIMATE_TIMEOUT = 60 * 10
+
 LEN_OF_POSTS = 15
 
 NUM_POSTS_PAG_TEST = 15
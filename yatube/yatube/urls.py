@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+
+from core.views import media
 
 
 urlpatterns = [
@@ -10,6 +11,8 @@ urlpatterns = [
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls', namespace='about')),
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', media,
+         name='media'),
 ]
 
 handler404 = 'core.views.page_not_found'
@@ -19,7 +22,4 @@ handler403 = 'core.views.permission_denied'
 if settings.DEBUG:
     import debug_toolbar
 
-    urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
-    )
     urlpatterns += (path('__debug__/', include(debug_toolbar.urls)),)